@@ -0,0 +1,125 @@
+"""
+Rates that shrink when this process is under load, so that ratelimiting
+sheds load during incidents.
+"""
+import asyncio
+import collections
+import math
+import threading
+import time
+
+
+__all__ = ['AdaptiveRate', 'LoadMonitor', 'monitor', 'watch_event_loop']
+
+
+class LoadMonitor:
+    """
+    Collects load signals for this process. RatelimitMiddleware reports
+    every request it handles to the module-level ``monitor``.
+    """
+    def __init__(self, samples=1000):
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self._durations = collections.deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, duration):
+        with self._lock:
+            self.in_flight -= 1
+        self._durations.append(duration)
+
+    def record_loop_lag(self, lag):
+        self.loop_lag = lag
+
+    def p95(self):
+        """The 95th percentile duration of recent requests, in seconds."""
+        durations = sorted(self._durations)
+        if not durations:
+            return 0.0
+        return durations[max(math.ceil(len(durations) * 0.95) - 1, 0)]
+
+    def reset(self):
+        with self._lock:
+            self.in_flight = 0
+        self.loop_lag = 0.0
+        self._durations.clear()
+
+
+monitor = LoadMonitor()
+
+
+async def watch_event_loop(interval=0.5):
+    """
+    Measure how late the running event loop wakes up from sleep, and
+    report it to the monitor. Run as a background task, e.g. from an ASGI
+    lifespan handler.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        monitor.record_loop_lag(max(loop.time() - start - interval, 0.0))
+
+
+class AdaptiveRate:
+    """
+    Wraps a rate, and scales its limit down while any load signal is over
+    its threshold.
+
+    Every ``interval`` seconds, the limit is multiplied by ``decrease`` if
+    the process is overloaded, down to ``min_factor`` of the configured
+    limit, or else recovers by ``recover`` of the configured limit. The
+    counters are kept under the configured rate, so scaling the limit does
+    not reset them.
+    """
+    def __init__(self, rate, max_in_flight=None, max_p95=None,
+                 max_loop_lag=None, min_factor=0.1, decrease=0.5,
+                 recover=0.1, interval=1.0, monitor=monitor):
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.max_p95 = max_p95
+        self.max_loop_lag = max_loop_lag
+        self.min_factor = min_factor
+        self.decrease = decrease
+        self.recover = recover
+        self.interval = interval
+        self.monitor = monitor
+        self.factor = 1.0
+        self._checked = time.monotonic()
+
+    def __repr__(self):
+        return '<AdaptiveRate rate=%r factor=%.2f>' % (self.rate, self.factor)
+
+    def overloaded(self):
+        m = self.monitor
+        if self.max_in_flight is not None:
+            if m.in_flight > self.max_in_flight:
+                return True
+        if self.max_loop_lag is not None:
+            if m.loop_lag > self.max_loop_lag:
+                return True
+        if self.max_p95 is not None:
+            if m.p95() > self.max_p95:
+                return True
+        return False
+
+    def get_factor(self):
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return self.factor
+        self._checked = now
+        if self.overloaded():
+            self.factor = max(self.factor * self.decrease, self.min_factor)
+        else:
+            self.factor = min(self.factor + self.recover, 1.0)
+        return self.factor
+
+    def scale_limit(self, limit):
+        # Round up, so small rates aren't scaled down to nothing, but not
+        # on float noise from adding up recover.
+        scaled = math.ceil(round(limit * self.get_factor(), 9))
+        return max(1, scaled)
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from django_ratelimit.models import Rate
+
+
+@admin.register(Rate)
+class RateAdmin(admin.ModelAdmin):
+    list_display = ('group', 'value', 'rate')
+    list_filter = ('group',)
+    search_fields = ('group', 'value')
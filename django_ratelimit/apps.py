@@ -5,6 +5,8 @@ class DjangoRatelimitConfig(AppConfig):
     name = 'django_ratelimit'
     label = 'ratelimit'
     default = True
+    default_auto_field = 'django.db.models.BigAutoField'
 
     def ready(self):
         from . import checks  # noqa: F401
+        from . import rates  # noqa: F401
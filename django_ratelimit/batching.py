@@ -0,0 +1,148 @@
+"""
+Batch counter increments from concurrent requests on an event loop, so that
+each tick costs one trip to the cache instead of one per request.
+"""
+import asyncio
+import socket
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+
+__all__ = ['CounterBatcher', 'get_batcher']
+
+
+def _redis_client(cache):
+    """Return django-redis's client for writes, or None."""
+    get_client = getattr(getattr(cache, 'client', None), 'get_client', None)
+    if get_client is None:
+        return None
+    return get_client(write=True)
+
+
+def _apply(cache_name, totals):
+    """
+    Add each delta in ``totals``, a dict of cache key to (delta, timeout),
+    to its counter, and return a dict of the new counts.
+    """
+    cache = caches[cache_name]
+    client = _redis_client(cache)
+    if client is not None:
+        # Create each counter with its expiry if it's missing, and
+        # increment it, all in one pipelined round trip.
+        pipe = client.pipeline(transaction=False)
+        for key, (delta, timeout) in totals.items():
+            redis_key = cache.client.make_key(key)
+            pipe.set(redis_key, 0, ex=timeout, nx=True)
+            pipe.incrby(redis_key, delta)
+        results = pipe.execute()
+        return dict(zip(totals, results[1::2]))
+
+    counts = {}
+    for key, (delta, timeout) in totals.items():
+        try:
+            added = cache.add(key, delta, timeout)
+        except socket.gaierror:  # for redis
+            added = False
+        if added:
+            counts[key] = delta
+            continue
+        try:
+            counts[key] = cache.incr(key, delta)
+        except ValueError:
+            counts[key] = None
+    return counts
+
+
+class CounterBatcher:
+    """
+    Collects increments for ``window`` seconds, or until there are
+    ``max_size`` of them, then sends them to the cache together. Increments
+    of the same counter are added up and sent once. Defaults to
+    RATELIMIT_BATCH_WINDOW and RATELIMIT_BATCH_SIZE.
+    """
+    def __init__(self, window=None, max_size=None):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._handle = None
+        # The event loop only keeps weak references to tasks.
+        self._sending = set()
+
+    def _get_window(self):
+        if self.window is not None:
+            return self.window
+        return getattr(settings, 'RATELIMIT_BATCH_WINDOW', 0.001)
+
+    def _get_max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'RATELIMIT_BATCH_SIZE', 100)
+
+    async def incr(self, key, delta, timeout):
+        """
+        Add ``delta`` to the counter at ``key``, creating it with
+        ``timeout`` if it's missing, and return its new count, or None if
+        the cache failed, in any way.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((key, delta, timeout, future))
+        if len(self._pending) >= self._get_max_size():
+            self.flush()
+        elif self._handle is None:
+            self._handle = loop.call_later(self._get_window(), self.flush)
+        return await future
+
+    def flush(self):
+        """Send every pending increment now."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        totals = {}
+        for key, delta, timeout, _ in batch:
+            total = totals.get(key)
+            totals[key] = (delta if total is None else total[0] + delta,
+                           timeout)
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+        try:
+            counts = await sync_to_async(_apply, thread_sensitive=False)(
+                cache_name, totals)
+        except Exception:
+            # Like a failed incr: the requests fail closed, or open with
+            # RATELIMIT_FAIL_OPEN.
+            counts = {}
+
+        # Give each request the count as if its increment had been sent on
+        # its own, in the order they arrived.
+        running = {}
+        for key, delta, _, future in batch:
+            count = counts.get(key)
+            if count is None or count is False:
+                result = None
+            else:
+                result = running.get(key, count - totals[key][0]) + delta
+                running[key] = result
+            if not future.done():
+                future.set_result(result)
+
+
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_batcher():
+    """Return the CounterBatcher for the running event loop."""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = _batchers[loop] = CounterBatcher()
+    return batcher
@@ -0,0 +1,142 @@
+"""
+Tell every node when a counter goes over its limit, so that the others can
+limit requests for it without asking the cache until its window ends.
+Enabled by RATELIMIT_BROADCAST.
+"""
+import collections
+import functools
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_ratelimit.core import _get_now, _import_string
+
+
+__all__ = ['Broadcast', 'LocalBroadcast', 'RedisBroadcast',
+           'load_broadcast']
+
+
+class Broadcast:
+    """
+    Publishes counters that have gone over their limit, and keeps a local
+    map of the ones published by any node, up to ``max_size`` of them.
+    Subclasses implement send() and start().
+    """
+    def __init__(self, channel=None, max_size=None):
+        if channel is None:
+            channel = getattr(settings, 'RATELIMIT_BROADCAST_CHANNEL',
+                              'ratelimit:limited')
+        if max_size is None:
+            max_size = getattr(settings, 'RATELIMIT_BROADCAST_SIZE', 10000)
+        self.channel = channel
+        self.max_size = max_size
+        self._limited = {}
+
+    def limited_until(self, cache_key, now):
+        """
+        Return when the counter's window ends, if it is known to be over
+        its limit, or None.
+        """
+        until = self._limited.get(cache_key)
+        if until is None:
+            return None
+        if until <= now:
+            self._limited.pop(cache_key, None)
+            return None
+        return until
+
+    def _add(self, cache_key, until):
+        if len(self._limited) >= self.max_size:
+            now = _get_now()
+            self._limited = {k: v for k, v in self._limited.items()
+                             if v > now}
+            if len(self._limited) >= self.max_size:
+                self._limited = {}
+        self._limited[cache_key] = until
+
+    def publish(self, cache_key, until):
+        self._add(cache_key, until)
+        try:
+            self.send('%d:%s' % (until, cache_key))
+        except Exception:
+            # The other nodes still have the cache to tell them.
+            pass
+
+    def receive(self, message):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        until, cache_key = message.split(':', 1)
+        self._add(cache_key, int(until))
+
+    def clear(self):
+        self._limited = {}
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def start(self):
+        """Start receiving messages from other nodes."""
+        raise NotImplementedError
+
+
+class LocalBroadcast(Broadcast):
+    """
+    Broadcasts to the other LocalBroadcasts on the same channel, in this
+    process. A stand-in for RedisBroadcast in tests.
+    """
+    _subscribers = collections.defaultdict(weakref.WeakSet)
+
+    def start(self):
+        self._subscribers[self.channel].add(self)
+
+    def send(self, message):
+        for subscriber in list(self._subscribers[self.channel]):
+            if subscriber is not self:
+                subscriber.receive(message)
+
+
+class RedisBroadcast(Broadcast):
+    """
+    Broadcasts with Redis pub/sub, through the django-redis client of the
+    ratelimit cache. Messages are received by a daemon thread.
+    """
+    def __init__(self, channel=None, max_size=None, cache_name=None):
+        super().__init__(channel, max_size)
+        self.cache_name = cache_name
+        self._thread = None
+
+    def _client(self):
+        cache_name = self.cache_name or getattr(
+            settings, 'RATELIMIT_USE_CACHE', 'default')
+        return caches[cache_name].client.get_client(write=True)
+
+    def send(self, message):
+        self._client().publish(self.channel, message)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, daemon=True,
+                                        name='ratelimit-broadcast')
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.receive(message['data'])
+            except Exception:
+                # Reconnect. Until then, this node just asks the cache.
+                time.sleep(1)
+
+
+@functools.lru_cache(maxsize=None)
+def load_broadcast(path):
+    """Create and start the process's Broadcast, once."""
+    cls = _import_string(path) if isinstance(path, str) else path
+    broadcast = cls()
+    broadcast.start()
+    return broadcast
@@ -5,6 +5,7 @@ SUPPORTED_CACHE_BACKENDS = [
     'django.core.cache.backends.memcached.PyMemcacheCache',
     'django.core.cache.backends.memcached.PyLibMCCache',
     'django_redis.cache.RedisCache',
+    'django_ratelimit.shm.SharedMemoryCache',
 ]
 
 CACHE_FAKE = 'is not a real cache'
@@ -67,3 +68,47 @@ def check_caches(app_configs, **kwargs):
         )
 
     return errors
+
+
+@checks.register(checks.Tags.caches, 'django_ratelimit', deploy=True)
+def check_cache_probe(app_configs, **kwargs):
+    if not getattr(settings, 'RATELIMIT_PROBE_CACHE', False):
+        return []
+
+    from django_ratelimit.probe import probe_cache
+
+    try:
+        result = probe_cache()
+    except Exception as e:
+        return [
+            checks.Error(
+                f'could not increment a counter in the ratelimit cache: {e}',
+                hint='Check that the cache is running and reachable',
+                id='django_ratelimit.E004',
+            )
+        ]
+
+    errors = []
+    if not result['correct']:
+        errors.append(
+            checks.Error(
+                f'the ratelimit cache counted {result["count"]} of '
+                f'{result["expected"]} concurrent increments',
+                hint='Use a cache backend with atomic increment',
+                id='django_ratelimit.E005',
+            )
+        )
+
+    max_latency = getattr(settings, 'RATELIMIT_PROBE_MAX_LATENCY', 0.01)
+    slow = [op for op, latency in result['latency'].items()
+            if latency['p99'] > max_latency]
+    if slow:
+        errors.append(
+            checks.Warning(
+                f'99th percentile latency of ratelimit cache '
+                f'{", ".join(slow)} is over {max_latency * 1000:g}ms',
+                hint='Run manage.py ratelimit_bench for details',
+                id='django_ratelimit.W002',
+            )
+        )
+    return errors
@@ -1,10 +1,8 @@
-import ipaddress
+import base64
 import functools
-import hashlib
 import re
 import socket
 import time
-import zlib
 
 from django.conf import settings
 from django.core.cache import caches
@@ -14,7 +12,9 @@ from django.utils.module_loading import import_string
 from django_ratelimit import ALL, UNSAFE
 
 
-__all__ = ['is_ratelimited', 'get_usage']
+__all__ = ['is_ratelimited', 'get_usage', 'peek_usage_many',
+           'get_key_footprint', 'compile_limit', 'Limit',
+           'compile_concurrency_limit', 'ConcurrencyLimit']
 
 _PERIODS = {
     's': 1,
@@ -26,8 +26,28 @@ _PERIODS = {
 # Extend the expiration time by a few seconds to avoid misses.
 EXPIRATION_FUDGE = 5
 
+_KEY_ENCODINGS = {
+    'hex': lambda d: d.hex(),
+    'base64': lambda d: base64.urlsafe_b64encode(d).rstrip(b'=').decode(),
+    'base85': lambda d: base64.b85encode(d).decode(),
+}
 
-def _get_ip(request):
+_import_string = functools.lru_cache(maxsize=None)(import_string)
+
+# Truncating the digest below 64 bits makes collisions between live
+# counters likely enough to matter.
+MIN_KEY_DIGEST_SIZE = 8
+
+# Approximate per-item bookkeeping in bytes: the item header and CAS value
+# for memcached, and the dict entries, object header and TTL entry for
+# redis.
+_KEY_OVERHEAD = {
+    'memcached': 56,
+    'redis': 72,
+}
+
+
+def _get_client_ip(request):
     ip_meta = getattr(settings, 'RATELIMIT_IP_META_KEY', None)
     if not ip_meta:
         ip = request.META['REMOTE_ADDR']
@@ -40,14 +60,18 @@ def _get_ip(request):
     elif callable(ip_meta):
         ip = ip_meta(request)
     elif isinstance(ip_meta, str) and '.' in ip_meta:
-        ip_meta_fn = import_string(ip_meta)
+        ip_meta_fn = _import_string(ip_meta)
         ip = ip_meta_fn(request)
     elif ip_meta in request.META:
         ip = request.META[ip_meta]
     else:
         raise ImproperlyConfigured(
             'Could not get IP address from "%s"' % ip_meta)
+    return ip
 
+
+def _get_ip(request):
+    ip = _get_client_ip(request)
     if ':' in ip:
         # IPv6
         mask = getattr(settings, 'RATELIMIT_IPV6_MASK', 64)
@@ -55,21 +79,136 @@ def _get_ip(request):
         # IPv4
         mask = getattr(settings, 'RATELIMIT_IPV4_MASK', 32)
 
-    network = ipaddress.ip_network(f'{ip}/{mask}', strict=False)
+    return _mask_ip(ip, mask)
+
 
+@functools.lru_cache(maxsize=1024)
+def _mask_ip(ip, mask):
+    import ipaddress
+
+    address = ipaddress.ip_address(ip)
+    if mask >= address.max_prefixlen:
+        # Nothing to mask, but the address is still validated and
+        # normalized.
+        return str(address)
+    network = ipaddress.ip_network(f'{ip}/{mask}', strict=False)
     return str(network.network_address)
 
 
+@functools.lru_cache(maxsize=16)
+def _compile_networks(networks):
+    """
+    Compile a tuple of networks to sorted, non-overlapping ranges of
+    integers for each IP version, to look addresses up with bisect.
+    """
+    import ipaddress
+
+    ranges = {4: [], 6: []}
+    for network in networks:
+        try:
+            network = ipaddress.ip_network(network, strict=False)
+        except ValueError:
+            raise ImproperlyConfigured('Invalid network: %s' % network)
+        ranges[network.version].append((int(network.network_address),
+                                        int(network.broadcast_address)))
+    compiled = {}
+    for version, version_ranges in ranges.items():
+        starts, ends = [], []
+        for start, end in sorted(version_ranges):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        compiled[version] = (starts, ends)
+    return compiled
+
+
+def _in_networks(address, networks):
+    from bisect import bisect_right
+
+    starts, ends = _compile_networks(tuple(networks))[address.version]
+    n = int(address)
+    i = bisect_right(starts, n) - 1
+    return i >= 0 and n <= ends[i]
+
+
+NETWORK_ALLOW = 'allow'
+NETWORK_DENY = 'deny'
+
+
+def _get_network_rule(request):
+    """
+    Return NETWORK_DENY or NETWORK_ALLOW if the client's IP address is in
+    RATELIMIT_DENY_NETWORKS or RATELIMIT_ALLOW_NETWORKS, in that order, or
+    None.
+    """
+    allow = getattr(settings, 'RATELIMIT_ALLOW_NETWORKS', None)
+    deny = getattr(settings, 'RATELIMIT_DENY_NETWORKS', None)
+    if not allow and not deny:
+        return None
+    try:
+        return request._ratelimit_network
+    except AttributeError:
+        pass
+
+    import ipaddress
+
+    rule = None
+    try:
+        address = ipaddress.ip_address(_get_client_ip(request))
+    except ValueError:
+        # Not an address we can place in a network, e.g. a malformed
+        # proxy header. Limits keyed on it will see it as it is.
+        address = None
+    if address is not None:
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if deny and _in_networks(address, deny):
+            rule = NETWORK_DENY
+        elif allow and _in_networks(address, allow):
+            rule = NETWORK_ALLOW
+    request._ratelimit_network = rule
+    return rule
+
+
 def user_or_ip(request):
     if request.user.is_authenticated:
         return str(request.user.pk)
     return _get_ip(request)
 
 
+def _get_session_user_id(request):
+    """
+    Return the authenticated user's primary key as a string, or None,
+    without loading the user from the database.
+    """
+    # If something already resolved request.user, it costs nothing to use.
+    user = getattr(request, '_cached_user', None)
+    if user is not None:
+        return str(user.pk) if user.is_authenticated else None
+    session = getattr(request, 'session', None)
+    if session is None:
+        return None
+    from django.contrib.auth import SESSION_KEY
+    user_id = session.get(SESSION_KEY)
+    return None if user_id is None else str(user_id)
+
+
+def user_id(request):
+    return _get_session_user_id(request) or ''
+
+
+def user_id_or_ip(request):
+    return _get_session_user_id(request) or _get_ip(request)
+
+
 _SIMPLE_KEYS = {
     'ip': lambda r: _get_ip(r),
     'user': lambda r: str(r.user.pk),
     'user_or_ip': user_or_ip,
+    'user_id': user_id,
+    'user_id_or_ip': user_id_or_ip,
 }
 
 
@@ -82,24 +221,31 @@ _ACCESSOR_KEYS = {
     'get': lambda r, k: r.GET.get(k, ''),
     'post': lambda r, k: r.POST.get(k, ''),
     'header': get_header,
+    'cookie': lambda r, k: r.COOKIES.get(k, ''),
+    'signed_cookie': lambda r, k: r.get_signed_cookie(k, default=''),
 }
 
 
-def _method_match(request, method=ALL):
-    if method == ALL:
-        return True
-    if not isinstance(method, (list, tuple)):
-        method = [method]
-    return request.method in [m.upper() for m in method]
+_RATE_PATTERN = r'([\d]+)/([\d]*)([smhd])?'
 
 
-rate_re = re.compile(r'([\d]+)/([\d]*)([smhd])?')
+def __getattr__(name):
+    # The pattern is compiled by the re module's cache the first time a rate
+    # is parsed; rate_re is kept for code that imports it.
+    if name == 'rate_re':
+        return re.compile(_RATE_PATTERN)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def _split_rate(rate):
     if isinstance(rate, tuple):
         return rate
-    count, multi, period = rate_re.match(rate).groups()
+    return _parse_rate(rate)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_rate(rate):
+    count, multi, period = re.match(_RATE_PATTERN, rate).groups()
     count = int(count)
     if not period:
         period = 's'
@@ -109,21 +255,62 @@ def _split_rate(rate):
     return count, seconds
 
 
-def _get_window(value, period):
+if hasattr(time, 'CLOCK_REALTIME_COARSE'):
+    def coarse_time():
+        """
+        A cheaper, lower resolution alternative to time.time(), updated by
+        the kernel every few milliseconds.
+        """
+        return time.clock_gettime(time.CLOCK_REALTIME_COARSE)
+else:
+    coarse_time = time.time
+
+
+def _get_clock():
+    clock = getattr(settings, 'RATELIMIT_CLOCK', None)
+    if clock is None:
+        return time.time
+    if isinstance(clock, str):
+        return _import_string(clock)
+    return clock
+
+
+def _get_now(request=None):
+    """
+    Return the current time in whole seconds. The first call for a request
+    takes a snapshot that is shared by every limit applied to it.
+    """
+    if request is None:
+        return int(_get_clock()())
+    try:
+        return request._ratelimit_now
+    except AttributeError:
+        now = request._ratelimit_now = int(_get_clock()())
+        return now
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_jitter(value):
+    import zlib
+
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return zlib.crc32(value)
+
+
+def _get_window(value, period, now=None):
     """
     Given a value, and time period return when the end of the current time
     period for rate evaluation is.
     """
-    ts = int(time.time())
+    ts = _get_now() if now is None else now
     if period == 1:
         return ts
-    if not isinstance(value, bytes):
-        value = value.encode('utf-8')
     # This logic determines either the last or current end of a time period.
     # Subtracting (ts % period) gives us the a consistent edge from the epoch.
     # We use (zlib.crc32(value) % period) to add a consistent jitter so that
     # all time periods don't end at the same time.
-    w = ts - (ts % period) + (zlib.crc32(value) % period)
+    w = ts - (ts % period) + (_get_jitter(value) % period)
     if w < ts:
         return w + period
     return w
@@ -134,117 +321,559 @@ def _make_cache_key(group, window, rate, value, methods):
     safe_rate = '%d/%ds' % (count, period)
     parts = [group, safe_rate, value, str(window)]
     if methods is not None:
-        if methods == ALL:
-            methods = ''
-        elif isinstance(methods, (list, tuple)):
-            methods = ''.join(sorted([m.upper() for m in methods]))
-        parts.append(methods)
+        parts.append(_methods_suffix(methods))
+    return _hash_key(parts)
+
+
+def _hash_key(parts):
     prefix = getattr(settings, 'RATELIMIT_CACHE_PREFIX', 'rl:')
-    attr = getattr(settings, 'RATELIMIT_HASH_ALGORITHM', hashlib.sha256)
-    algo_cls = (import_string(f'{attr}')
-                if isinstance(attr, str)
-                else attr
-                )
-    return prefix + algo_cls(''.join(parts).encode('utf-8')).hexdigest()
+    attr = getattr(settings, 'RATELIMIT_HASH_ALGORITHM', None)
+    if attr is None:
+        import hashlib
+        algo_cls = hashlib.sha256
+    else:
+        algo_cls = (_import_string(f'{attr}')
+                    if isinstance(attr, str)
+                    else attr
+                    )
+    return prefix + _encode_digest(algo_cls(''.join(parts).encode('utf-8')))
+
+
+def _encode_digest(hashed):
+    encoding = getattr(settings, 'RATELIMIT_KEY_ENCODING', 'hex')
+    size = getattr(settings, 'RATELIMIT_KEY_DIGEST_SIZE', None)
+    if encoding == 'hex' and size is None:
+        return hashed.hexdigest()
+    if encoding not in _KEY_ENCODINGS:
+        raise ImproperlyConfigured(
+            'Unknown RATELIMIT_KEY_ENCODING: %s' % encoding)
+    digest = hashed.digest()
+    if size is not None:
+        if size < MIN_KEY_DIGEST_SIZE:
+            raise ImproperlyConfigured(
+                'RATELIMIT_KEY_DIGEST_SIZE must be at least %d bytes' %
+                MIN_KEY_DIGEST_SIZE)
+        digest = digest[:size]
+    return _KEY_ENCODINGS[encoding](digest)
+
+
+def get_key_footprint(limit=1):
+    """
+    Estimate the memory, in bytes, used by each counter in the configured
+    cache, given the current key settings.
+
+    Counters are stored as plain integers, which the memcached and redis
+    backends store as their decimal string rather than pickling, so the
+    value size depends on the limit.
+    """
+    cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+    cache = caches[cache_name]
+    key = cache.make_key(_make_cache_key('', 0, (1, 1), '', ALL))
+    backend = settings.CACHES[cache_name]['BACKEND'].lower()
+    overhead = _KEY_OVERHEAD['redis' if 'redis' in backend else 'memcached']
+    key_bytes = len(key.encode('utf-8'))
+    value_bytes = len(str(limit + 1))
+    return {
+        'key_bytes': key_bytes,
+        'value_bytes': value_bytes,
+        'overhead_bytes': overhead,
+        'total_bytes': key_bytes + value_bytes + overhead,
+    }
 
 
 def is_ratelimited(request, group=None, fn=None, key=None, rate=None,
-                   method=ALL, increment=False):
-    usage = get_usage(request, group, fn, key, rate, method, increment)
+                   method=ALL, increment=False, cost=1, quota=False,
+                   penalty=None):
+    usage = get_usage(request, group, fn, key, rate, method, increment, cost,
+                      quota, penalty)
     if usage is None:
         return False
 
     return usage['should_limit']
 
 
-def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
-              increment=False):
-    if group is None and fn is None:
-        raise ImproperlyConfigured('get_usage must be called with either '
-                                   '`group` or `fn` arguments')
+def _get_cost(cost, group, request):
+    if callable(cost):
+        cost = cost(group, request)
+    elif isinstance(cost, str):
+        costfn = _import_string(cost)
+        cost = costfn(group, request)
+    if isinstance(cost, bool) or not isinstance(cost, int) or cost < 0:
+        raise ImproperlyConfigured(
+            'Ratelimit cost must be a non-negative integer, got %r' % cost)
+    return cost
 
-    if not getattr(settings, 'RATELIMIT_ENABLE', True):
-        return None
 
-    if not _method_match(request, method):
-        return None
+def _get_group(fn):
+    parts = []
 
-    if group is None:
-        parts = []
+    if isinstance(fn, functools.partial):
+        fn = fn.func
 
-        if isinstance(fn, functools.partial):
-            fn = fn.func
+    # Django <2.1 doesn't use a partial. This is ugly and inelegant, but
+    # throwing __qualname__ into the list below helps.
+    if fn.__name__ == 'bound_func':
+        fn = fn.__closure__[0].cell_contents
 
-        # Django <2.1 doesn't use a partial. This is ugly and inelegant, but
-        # throwing __qualname__ into the list below helps.
-        if fn.__name__ == 'bound_func':
-            fn = fn.__closure__[0].cell_contents
+    if hasattr(fn, '__module__'):
+        parts.append(fn.__module__)
 
-        if hasattr(fn, '__module__'):
-            parts.append(fn.__module__)
+    if hasattr(fn, '__self__'):
+        parts.append(fn.__self__.__class__.__name__)
 
-        if hasattr(fn, '__self__'):
-            parts.append(fn.__self__.__class__.__name__)
+    parts.append(fn.__qualname__)
+    return '.'.join(parts)
 
-        parts.append(fn.__qualname__)
-        group = '.'.join(parts)
 
-    if callable(rate):
-        rate = rate(group, request)
-    elif isinstance(rate, str) and '.' in rate:
-        ratefn = import_string(rate)
-        rate = ratefn(group, request)
+def _raise(message):
+    # Configuration errors are raised when the limit is checked, not when it
+    # is compiled, so that a misconfigured limit only breaks its own view.
+    def _compiled(group, request):
+        raise ImproperlyConfigured(message)
+    _compiled._ratelimit_error = message
+    return _compiled
+
+
+def _lazy_import(path):
+    # Dotted paths are imported on first use, since they often point back
+    # into the module being decorated.
+    def _compiled(group, request):
+        return _import_string(path)(group, request)
+    _compiled._ratelimit_path = path
+    return _compiled
 
-    if rate is None:
-        return None
-    limit, period = _split_rate(rate)
-    if period <= 0:
-        raise ImproperlyConfigured('Ratelimit period must be greater than 0')
 
+def _check_compiled(fn):
+    """
+    Return a list of errors in a compiled key or rate, importing any
+    dotted paths it uses.
+    """
+    error = getattr(fn, '_ratelimit_error', None)
+    if error is not None:
+        return [error]
+    path = getattr(fn, '_ratelimit_path', None)
+    if path is not None:
+        try:
+            _import_string(path)
+        except ImportError as e:
+            return [str(e)]
+    errors = []
+    for part in getattr(fn, '_ratelimit_parts', ()):
+        errors.extend(_check_compiled(part))
+    return errors
+
+
+# Joins the parts of composite keys, each prefixed with its length, since
+# values like get: and post: are chosen by the client and may contain it.
+COMPOSITE_KEY_SEPARATOR = '\x1f'
+
+
+def _compile_key(key):
+    """Return a callable taking (group, request) that returns the key value."""
     if not key:
-        raise ImproperlyConfigured('Ratelimit key must be specified')
+        return _raise('Ratelimit key must be specified')
     if callable(key):
-        value = key(group, request)
-    elif key in _SIMPLE_KEYS:
-        value = _SIMPLE_KEYS[key](request)
-    elif ':' in key:
+        return key
+    if isinstance(key, (list, tuple)):
+        return _compile_composite_key(key)
+    if key in _SIMPLE_KEYS:
+        keyfn = _SIMPLE_KEYS[key]
+        return lambda group, request: keyfn(request)
+    if ':' in key:
         accessor, k = key.split(':', 1)
         if accessor not in _ACCESSOR_KEYS:
-            raise ImproperlyConfigured('Unknown ratelimit key: %s' % key)
-        value = _ACCESSOR_KEYS[accessor](request, k)
-    elif '.' in key:
-        keyfn = import_string(key)
-        value = keyfn(group, request)
-    else:
-        raise ImproperlyConfigured(
-            'Could not understand ratelimit key: %s' % key)
+            return _raise('Unknown ratelimit key: %s' % key)
+        accessorfn = _ACCESSOR_KEYS[accessor]
+        return lambda group, request: accessorfn(request, k)
+    if '.' in key:
+        return _lazy_import(key)
+    return _raise('Could not understand ratelimit key: %s' % key)
 
-    window = _get_window(value, period)
-    initial_value = 1 if increment else 0
 
-    cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
-    cache = caches[cache_name]
-    cache_key = _make_cache_key(group, window, rate, value, method)
+def _compile_composite_key(keys):
+    keyfns = tuple(_compile_key(key) for key in keys)
+    if len(keyfns) == 1:
+        return keyfns[0]
 
-    count = None
-    try:
-        added = cache.add(cache_key, initial_value, period + EXPIRATION_FUDGE)
-    except socket.gaierror:  # for redis
-        added = False
-    if added:
-        count = initial_value
-    else:
+    def _compiled(group, request):
+        values = [keyfn(group, request) for keyfn in keyfns]
+        return COMPOSITE_KEY_SEPARATOR.join(
+            ['%d:%s' % (len(value), value) for value in values])
+    _compiled._ratelimit_parts = keyfns
+    return _compiled
+
+
+# Keys that only read the request, so they can be worked out on the event
+# loop. Other keys may use the ORM, e.g. through request.user.
+_INLINE_ACCESSORS = frozenset(['get', 'post', 'header'])
+
+
+def _is_inline_key(key):
+    if isinstance(key, (list, tuple)):
+        return all(_is_inline_key(k) for k in key)
+    if not isinstance(key, str):
+        return False
+    return key == 'ip' or key.split(':', 1)[0] in _INLINE_ACCESSORS
+
+
+def _compile_rate(rate):
+    """
+    Return a callable taking (group, request) that returns the rate, the
+    split rate if it is the same for every request, and a callable to scale
+    the limit, if any.
+    """
+    # Rates like AdaptiveRate wrap another rate, and adjust its limit
+    # without changing the counter it uses.
+    scale = getattr(rate, 'scale_limit', None)
+    if scale is not None:
+        ratefn, split, _ = _compile_rate(rate.rate)
+        return ratefn, split, scale
+    if callable(rate):
+        return rate, None, None
+    if isinstance(rate, str) and '.' in rate:
+        return _lazy_import(rate), None, None
+    split = None
+    if rate is not None:
+        try:
+            split = _split_rate(rate)
+        except (AttributeError, TypeError, ValueError):
+            return _raise('Invalid ratelimit rate: %r' % (rate,)), None, None
+        if split[1] <= 0:
+            return (_raise('Ratelimit period must be greater than 0'),
+                    None, None)
+    return (lambda group, request: rate), split, None
+
+
+def _compile_count_if(count_if):
+    if count_if is None or callable(count_if):
+        return count_if
+    if isinstance(count_if, str):
+        return _lazy_import(count_if)
+    return _raise('Ratelimit count_if must be a callable or dotted path')
+
+
+def _compile_methods(method):
+    if method == ALL:
+        return None
+    if not isinstance(method, (list, tuple)):
+        method = [method]
+    return frozenset(m.upper() for m in method)
+
+
+def _methods_suffix(methods):
+    if methods is None or methods == ALL:
+        return ''
+    if isinstance(methods, (list, tuple)):
+        return ''.join(sorted([m.upper() for m in methods]))
+    return methods
+
+
+class Limit:
+    """
+    A rate limit with its key, rate and method resolved ahead of time, so
+    that checking a request does no parsing. Create with compile_limit().
+    """
+    __slots__ = ('group', 'key', 'rate', 'method', 'cost', 'quota',
+                 'penalty', 'count_if', '_key', '_rate', '_split_rate',
+                 '_scale', '_methods', '_methods_suffix', '_inline')
+
+    def __init__(self, group, key, rate, method, cost, quota=False,
+                 penalty=None, count_if=None):
+        self.group = group
+        self.key = key
+        self.rate = rate
+        self.method = method
+        self.cost = cost
+        self.quota = quota
+        self.penalty = penalty
+        self.count_if = _compile_count_if(count_if)
+        self._key = _compile_key(key)
+        self._rate, self._split_rate, self._scale = _compile_rate(rate)
+        self._methods = _compile_methods(method)
+        self._methods_suffix = _methods_suffix(method)
+        # Whether aget_usage can resolve the limit without a thread.
+        fixed_rate = self._split_rate is not None and self._scale is None
+        self._inline = fixed_rate and _is_inline_key(key)
+
+    def __repr__(self):
+        return '<Limit group=%r key=%r rate=%r>' % (
+            self.group, self.key, self.rate)
+
+    def check(self):
+        """
+        Return a list of configuration errors, importing any dotted paths
+        ahead of the first request.
+        """
+        errors = _check_compiled(self._key) + _check_compiled(self._rate)
+        if self.count_if is not None:
+            errors.extend(_check_compiled(self.count_if))
+        return errors
+
+    def cache_key(self, window, limit, period, value):
+        return _hash_key([self.group, '%d/%ds' % (limit, period), value,
+                          str(window), self._methods_suffix])
+
+    def is_ratelimited(self, request, increment=False):
+        usage = self.get_usage(request, increment)
+        if usage is None:
+            return False
+
+        return usage['should_limit']
+
+    def is_exhausted(self, request):
+        """
+        Whether there is no room left under the limit for this request,
+        without counting it. For limits counted after the response with
+        count_if.
+        """
+        usage = self.get_usage(request)
+        if usage is None:
+            return False
+
+        return usage['should_limit'] or usage['count'] >= usage['limit']
+
+    def count_response(self, request, response):
+        """Count the request if count_if holds for its response."""
+        if self.count_if(request, response):
+            self.get_usage(request, increment=True)
+
+    def _resolve(self, request):
+        """
+        Work out everything about the request that doesn't need the cache.
+        Returns None if the limit doesn't apply, a usage dict if the
+        client's network decides it, or (limit, period, value,
+        cache_key_limit).
+        """
+        if not getattr(settings, 'RATELIMIT_ENABLE', True):
+            return None
+
+        if self._methods is not None and request.method not in self._methods:
+            return None
+
+        network_rule = _get_network_rule(request)
+        if network_rule is NETWORK_ALLOW:
+            return None
+        if network_rule is NETWORK_DENY:
+            return {
+                'count': 0,
+                'limit': 0,
+                'should_limit': True,
+                'time_left': -1,
+            }
+
+        if self._split_rate is not None:
+            limit, period = self._split_rate
+        else:
+            rate = self._rate(self.group, request)
+            if rate is None:
+                return None
+            limit, period = _split_rate(rate)
+        if period <= 0:
+            raise ImproperlyConfigured(
+                'Ratelimit period must be greater than 0')
+
+        value = self._key(self.group, request)
+        cache_key_limit = limit
+        if self._scale is not None:
+            limit = self._scale(limit)
+        return limit, period, value, cache_key_limit
+
+    def get_usage(self, request, increment=False):
+        resolved = self._resolve(request)
+        if resolved is None or isinstance(resolved, dict):
+            return resolved
+        return self._count(request, resolved, increment)
+
+    def _count(self, request, resolved, increment):
+        limit, period, value, cache_key_limit = resolved
+
+        group = self.group
+        now = _get_now(request)
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+        cache = caches[cache_name]
+        if self.penalty is not None:
+            banned_until = self.penalty.banned_until(cache, group, value, now)
+            if banned_until is not None:
+                return {
+                    'count': 0,
+                    'limit': limit,
+                    'should_limit': True,
+                    'time_left': banned_until - now,
+                }
+
+        window = _get_window(value, period, now)
         if increment:
+            initial_value = _get_cost(self.cost, group, request)
+
+        cache_key = self.cache_key(window, cache_key_limit, period, value)
+        broadcast = _get_broadcast()
+        if broadcast is not None:
+            until = broadcast.limited_until(cache_key, now)
+            if until is not None:
+                return {
+                    'count': 0,
+                    'limit': limit,
+                    'should_limit': True,
+                    'time_left': until - now,
+                }
+
+        count = None
+        if self.quota:
+            from django_ratelimit.quota import get_count
+            count = get_count(cache, cache_key, group, value, window,
+                              period + EXPIRATION_FUDGE, increment,
+                              initial_value if increment else 0)
+        elif increment:
+            try:
+                added = cache.add(cache_key, initial_value,
+                                  period + EXPIRATION_FUDGE)
+            except socket.gaierror:  # for redis
+                added = False
+            if added:
+                count = initial_value
+            else:
+                try:
+                    # python3-memcached will throw a ValueError if the server
+                    # is unavailable or (somehow) the key doesn't exist.
+                    # redis, on the other hand, simply returns None.
+                    count = cache.incr(cache_key, initial_value)
+                except ValueError:
+                    pass
+        else:
+            # Checking without incrementing never needs to write: a missing
+            # key is the same as a count of 0, and the next increment will
+            # add it.
             try:
-                # python3-memcached will throw a ValueError if the server is
-                # unavailable or (somehow) the key doesn't exist. redis, on the
-                # other hand, simply returns None.
-                count = cache.incr(cache_key)
-            except ValueError:
+                count = cache.get(cache_key, 0)
+            except socket.gaierror:  # for redis
                 pass
+
+        if increment and count and count - initial_value <= limit < count:
+            # This request took the counter over its limit.
+            if self.penalty is not None:
+                self.penalty.strike(cache, group, value, now)
+            if broadcast is not None:
+                broadcast.publish(cache_key, window)
+
+        return _make_usage(count, limit, window - now)
+
+    async def aget_usage(self, request, increment=False):
+        """
+        get_usage for async views. Increments from concurrent requests are
+        sent to the cache together, by django_ratelimit.batching.
+        """
+        resolved = await self._aresolve(request)
+        if resolved is None or isinstance(resolved, dict):
+            return resolved
+        return await self._acount(request, resolved, increment)
+
+    async def _aresolve(self, request):
+        if self._inline:
+            return self._resolve(request)
+
+        from asgiref.sync import sync_to_async
+
+        # Keys and rates may use the ORM, e.g. request.user or RateTable.
+        return await sync_to_async(self._resolve)(request)
+
+    async def _acount(self, request, resolved, increment):
+        from asgiref.sync import sync_to_async
+
+        if not increment or self.quota or self.penalty is not None:
+            return await sync_to_async(self._count)(request, resolved,
+                                                    increment)
+        limit, period, value, cache_key_limit = resolved
+
+        now = _get_now(request)
+        window = _get_window(value, period, now)
+        if callable(self.cost) or isinstance(self.cost, str):
+            cost = await sync_to_async(_get_cost)(self.cost, self.group,
+                                                  request)
         else:
-            count = cache.get(cache_key, initial_value)
+            cost = _get_cost(self.cost, self.group, request)
+        cache_key = self.cache_key(window, cache_key_limit, period, value)
+        broadcast = _get_broadcast()
+        if broadcast is not None:
+            until = broadcast.limited_until(cache_key, now)
+            if until is not None:
+                return {
+                    'count': 0,
+                    'limit': limit,
+                    'should_limit': True,
+                    'time_left': until - now,
+                }
+
+        from django_ratelimit.batching import get_batcher
+        count = await get_batcher().incr(cache_key, cost,
+                                         period + EXPIRATION_FUDGE)
+        if broadcast is not None and count and count - cost <= limit < count:
+            await sync_to_async(broadcast.publish, thread_sensitive=False)(
+                cache_key, window)
+        return _make_usage(count, limit, window - now)
+
+    async def ais_ratelimited(self, request, increment=False):
+        usage = await self.aget_usage(request, increment)
+        if usage is None:
+            return False
+
+        return usage['should_limit']
+
+    async def adelay(self, request, delay):
+        """
+        ais_ratelimited with increment, but a request over the limit waits
+        for the window to end, if it ends within ``delay`` seconds, and is
+        counted again in the next one. Returns whether it's still limited.
+        """
+        resolved = await self._aresolve(request)
+        if resolved is None:
+            return False
+        if isinstance(resolved, dict):
+            return resolved['should_limit']
+        usage = await self._acount(request, resolved, True)
+        if usage is None or not usage['should_limit']:
+            return False
+        time_left = usage['time_left']
+        if time_left < 0 or time_left > delay:
+            return True
+        # The next window won't admit more than the limit either.
+        if usage['count'] - usage['limit'] > usage['limit']:
+            return True
+
+        queue_key = (self.group, resolved[2])
+        depth = _delayed.get(queue_key, 0)
+        if depth >= getattr(settings, 'RATELIMIT_DELAY_QUEUE', 100):
+            return True
+        _delayed[queue_key] = depth + 1
+        try:
+            import asyncio
 
+            # Windows are whole seconds, and the last one is in the window.
+            window_end = request._ratelimit_now + time_left + 1
+            await asyncio.sleep(max(window_end - _get_clock()(), 0))
+        finally:
+            if _delayed[queue_key] > 1:
+                _delayed[queue_key] -= 1
+            else:
+                del _delayed[queue_key]
+        del request._ratelimit_now
+        # Count it with the same key and rate it was queued with.
+        usage = await self._acount(request, resolved, True)
+        return usage is not None and usage['should_limit']
+
+
+# How many requests are waiting in Limit.adelay, by group and key value.
+_delayed = {}
+
+
+def _get_broadcast():
+    path = getattr(settings, 'RATELIMIT_BROADCAST', None)
+    if path is None:
+        return None
+    from django_ratelimit.broadcast import load_broadcast
+    return load_broadcast(path)
+
+
+def _make_usage(count, limit, time_left):
     # Getting or setting the count from the cache failed
     if count is None or count is False:
         if getattr(settings, 'RATELIMIT_FAIL_OPEN', False):
@@ -256,7 +885,6 @@ def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
             'time_left': -1,
         }
 
-    time_left = window - int(time.time())
     return {
         'count': count,
         'limit': limit,
@@ -265,7 +893,196 @@ def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
     }
 
 
+def compile_limit(group=None, fn=None, key=None, rate=None, method=ALL,
+                  cost=1, quota=False, penalty=None, count_if=None):
+    """
+    Resolve a rate limit once, for checking many requests. Takes the same
+    arguments as get_usage, and ``count_if``, a callable that takes the
+    request and response and returns whether to count the request.
+    """
+    if group is None and fn is None:
+        raise ImproperlyConfigured('get_usage must be called with either '
+                                   '`group` or `fn` arguments')
+    if group is None:
+        group = _get_group(fn)
+    return Limit(group, key, rate, method, cost, quota, penalty, count_if)
+
+
+def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
+              increment=False, cost=1, quota=False, penalty=None):
+    limit = compile_limit(group, fn, key, rate, method, cost, quota, penalty)
+    return limit.get_usage(request, increment)
+
+
+class ConcurrencyLimit:
+    """
+    Limits the number of requests for the same key that are in progress at
+    once. Create with compile_concurrency_limit().
+
+    Each of the ``limit`` slots is a separate cache key, taken with add()
+    and given back with delete(). A slot expires after ``timeout`` seconds
+    even if it is never given back, e.g. if the process crashes. The slot
+    holds a token unique to the request, so that a request that outlived
+    its lease doesn't give back the slot of the request that took it over.
+    """
+    __slots__ = ('group', 'key', 'limit', 'timeout', 'method', '_key',
+                 '_methods', '_methods_suffix')
+
+    def __init__(self, group, key, limit, timeout, method):
+        self.group = group
+        self.key = key
+        self.limit = limit
+        self.timeout = timeout
+        self.method = method
+        self._key = _compile_key(key)
+        self._methods = _compile_methods(method)
+        self._methods_suffix = _methods_suffix(method)
+
+    def __repr__(self):
+        return '<ConcurrencyLimit group=%r key=%r limit=%r>' % (
+            self.group, self.key, self.limit)
+
+    def check(self):
+        errors = _check_compiled(self._key)
+        if not isinstance(self.limit, int) or self.limit < 0:
+            errors.append('Concurrency limit must be a non-negative integer')
+        return errors
+
+    def acquire(self, request):
+        """
+        Try to take a slot for the request. Returns a lease, the slot's
+        cache key and token, which must be passed to release(), True if the
+        limit does not apply to the request, or False if every slot is
+        taken.
+        """
+        if not getattr(settings, 'RATELIMIT_ENABLE', True):
+            return True
+
+        if self._methods is not None and request.method not in self._methods:
+            return True
+
+        network_rule = _get_network_rule(request)
+        if network_rule is not None:
+            return network_rule is NETWORK_ALLOW
+
+        if self.limit is None or self.limit < 0:
+            raise ImproperlyConfigured(
+                'Concurrency limit must be a non-negative integer')
+        if self.limit == 0:
+            return False
+
+        value = self._key(self.group, request)
+        base = _hash_key([self.group, 'concurrency/%d' % self.limit, value,
+                          self._methods_suffix])
+        slots = ['%s:%d' % (base, i) for i in range(self.limit)]
+
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+        cache = caches[cache_name]
+
+        # Read every slot in one round trip, then only try to take the ones
+        # that looked free, starting at random to spread out contention.
+        taken = cache.get_many(slots)
+        free = [slot for slot in slots if slot not in taken]
+        import random
+        import uuid
+        random.shuffle(free)
+        # An integer, for caches that only store integers.
+        token = uuid.uuid4().int >> 65
+        failed = False
+        for slot in free:
+            try:
+                added = cache.add(slot, token, self.timeout)
+            except socket.gaierror:  # for redis
+                added = None
+            if added:
+                return slot, token
+            if added is False and not failed:
+                # Memcached clients return False when the server is
+                # unavailable too, so check the slot is really held.
+                try:
+                    if cache.get(slot) is None:
+                        added = None
+                except socket.gaierror:  # for redis
+                    added = None
+            failed = failed or added is None
+
+        if failed and getattr(settings, 'RATELIMIT_FAIL_OPEN', False):
+            return True
+        return False
+
+    def release(self, lease):
+        if lease is True or lease is False:
+            return
+        slot, token = lease
+        cache = caches[getattr(settings, 'RATELIMIT_USE_CACHE', 'default')]
+        try:
+            # Only give back our own lease. Between the get and the delete
+            # it could still expire and be taken, but only by a request
+            # that outlived its timeout by those microseconds.
+            if cache.get(slot) == token:
+                cache.delete(slot)
+        except socket.gaierror:  # for redis
+            pass
+
+
+def compile_concurrency_limit(group=None, fn=None, key=None, limit=None,
+                              timeout=60, method=ALL):
+    if group is None and fn is None:
+        raise ImproperlyConfigured('compile_concurrency_limit must be called '
+                                   'with either `group` or `fn` arguments')
+    if group is None:
+        group = _get_group(fn)
+    return ConcurrencyLimit(group, key, limit, timeout, method)
+
+
+def peek_usage_many(group, rate, values, method=ALL):
+    """
+    Read the current usage for many key values at once, without
+    incrementing or writing anything to the cache.
+
+    Returns a dict mapping each value to a usage dict, as returned by
+    get_usage, or to None if ratelimiting is disabled.
+    """
+    if not getattr(settings, 'RATELIMIT_ENABLE', True):
+        return {value: None for value in values}
+
+    ratefn, split, scale = _compile_rate(rate)
+    if split is None:
+        if isinstance(rate, str) and '.' not in rate:
+            # An invalid rate: raise its error.
+            ratefn(group, None)
+        raise ImproperlyConfigured(
+            'peek_usage_many requires a fixed rate, got %r' % (rate,))
+    cache_key_limit, period = split
+    limit = cache_key_limit if scale is None else scale(cache_key_limit)
+
+    now = _get_now()
+    windows = {}
+    keys = {}
+    for value in values:
+        window = _get_window(value, period, now)
+        windows[value] = window
+        keys[value] = _make_cache_key(group, window, split, value, method)
+
+    cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+    cache = caches[cache_name]
+    counts = cache.get_many(keys.values())
+
+    usages = {}
+    for value, cache_key in keys.items():
+        count = counts.get(cache_key) or 0
+        usages[value] = {
+            'count': count,
+            'limit': limit,
+            'should_limit': count > limit,
+            'time_left': windows[value] - now,
+        }
+    return usages
+
+
 is_ratelimited.ALL = ALL
 is_ratelimited.UNSAFE = UNSAFE
 get_usage.ALL = ALL
 get_usage.UNSAFE = UNSAFE
+peek_usage_many.ALL = ALL
+peek_usage_many.UNSAFE = UNSAFE
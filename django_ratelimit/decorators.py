@@ -1,33 +1,130 @@
 from functools import wraps
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.utils.module_loading import import_string
+from django.core.exceptions import ImproperlyConfigured
 
 from django_ratelimit import ALL, UNSAFE
 from django_ratelimit.exceptions import Ratelimited
-from django_ratelimit.core import is_ratelimited
+from django_ratelimit.core import (compile_concurrency_limit, compile_limit,
+                                   _import_string)
 
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:  # asgiref < 3.6
+    from asyncio import iscoroutinefunction
 
-__all__ = ['ratelimit']
 
+__all__ = ['ratelimit', 'concurrencylimit']
 
-def ratelimit(group=None, key=None, rate=None, method=ALL, block=True):
+
+def _get_exception_class():
+    cls = getattr(settings, 'RATELIMIT_EXCEPTION_CLASS', Ratelimited)
+    return _import_string(cls) if isinstance(cls, str) else cls
+
+
+def _raise_ratelimited():
+    raise _get_exception_class()()
+
+
+def _add_limit(wrapped, limit):
+    # Keep a list of every limit applied to a view, outermost first, for
+    # django_ratelimit.warmup. wraps() has already copied the inner list.
+    wrapped._ratelimits = (limit,) + getattr(wrapped, '_ratelimits', ())
+
+
+def ratelimit(group=None, key=None, rate=None, method=ALL, block=True,
+              cost=1, quota=False, penalty=None, count_if=None, delay=None):
     def decorator(fn):
+        limit = compile_limit(group=group, fn=fn, key=key, rate=rate,
+                              method=method, cost=cost, quota=quota,
+                              penalty=penalty, count_if=count_if)
+        if delay and (count_if is not None or not iscoroutinefunction(fn)):
+            raise ImproperlyConfigured(
+                'delay is only supported on async views, without count_if')
+
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def _awrapped(request, *args, **kw):
+                old_limited = getattr(request, 'limited', False)
+                if delay:
+                    ratelimited = await limit.adelay(request, delay)
+                elif limit.count_if is None:
+                    ratelimited = await limit.ais_ratelimited(
+                        request, increment=True)
+                else:
+                    ratelimited = await sync_to_async(limit.is_exhausted)(
+                        request)
+                request.limited = ratelimited or old_limited
+                if ratelimited and block:
+                    _raise_ratelimited()
+                response = await fn(request, *args, **kw)
+                if limit.count_if is not None:
+                    await sync_to_async(limit.count_response)(request,
+                                                              response)
+                return response
+            _add_limit(_awrapped, limit)
+            return _awrapped
+
         @wraps(fn)
         def _wrapped(request, *args, **kw):
             old_limited = getattr(request, 'limited', False)
-            ratelimited = is_ratelimited(request=request, group=group, fn=fn,
-                                         key=key, rate=rate, method=method,
-                                         increment=True)
+            if limit.count_if is None:
+                ratelimited = limit.is_ratelimited(request, increment=True)
+            else:
+                ratelimited = limit.is_exhausted(request)
             request.limited = ratelimited or old_limited
             if ratelimited and block:
-                cls = getattr(
-                    settings, 'RATELIMIT_EXCEPTION_CLASS', Ratelimited)
-                raise (import_string(cls) if isinstance(cls, str) else cls)()
-            return fn(request, *args, **kw)
+                _raise_ratelimited()
+            if limit.count_if is None:
+                return fn(request, *args, **kw)
+            response = fn(request, *args, **kw)
+            limit.count_response(request, response)
+            return response
+        _add_limit(_wrapped, limit)
+        return _wrapped
+    return decorator
+
+
+def concurrencylimit(group=None, key=None, limit=None, timeout=60,
+                     method=ALL, block=True):
+    def decorator(fn):
+        concurrency = compile_concurrency_limit(
+            group=group, fn=fn, key=key, limit=limit, timeout=timeout,
+            method=method)
+
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def _awrapped(request, *args, **kw):
+                old_limited = getattr(request, 'limited', False)
+                slot = await sync_to_async(concurrency.acquire)(request)
+                request.limited = slot is False or old_limited
+                if slot is False and block:
+                    _raise_ratelimited()
+                try:
+                    return await fn(request, *args, **kw)
+                finally:
+                    await sync_to_async(concurrency.release)(slot)
+            _add_limit(_awrapped, concurrency)
+            return _awrapped
+
+        @wraps(fn)
+        def _wrapped(request, *args, **kw):
+            old_limited = getattr(request, 'limited', False)
+            slot = concurrency.acquire(request)
+            request.limited = slot is False or old_limited
+            if slot is False and block:
+                _raise_ratelimited()
+            try:
+                return fn(request, *args, **kw)
+            finally:
+                concurrency.release(slot)
+        _add_limit(_wrapped, concurrency)
         return _wrapped
     return decorator
 
 
 ratelimit.ALL = ALL
 ratelimit.UNSAFE = UNSAFE
+concurrencylimit.ALL = ALL
+concurrencylimit.UNSAFE = UNSAFE
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from django_ratelimit.probe import OPERATIONS, probe_cache
+
+
+class Command(BaseCommand):
+    help = ('Check that the ratelimit cache counts correctly under '
+            'concurrency, and measure the latency of the operations '
+            'ratelimiting uses.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cache',
+                            help='cache alias, default RATELIMIT_USE_CACHE')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--ops', type=int, default=1000,
+                            help='increments sent by each thread')
+
+    def handle(self, **options):
+        cache_name = options['cache'] or getattr(
+            settings, 'RATELIMIT_USE_CACHE', 'default')
+        if cache_name not in settings.CACHES:
+            raise CommandError(f'Unknown cache: {cache_name}')
+        try:
+            result = probe_cache(cache_name, options['threads'],
+                                 options['ops'])
+        except Exception as e:
+            raise CommandError(f'Cache error: {e!r}')
+
+        self.stdout.write(
+            f'cache={cache_name} threads={options["threads"]} '
+            f'ops={options["ops"]}')
+        self.stdout.write(f'increments: {result["count"]} of '
+                          f'{result["expected"]}')
+        self.stdout.write(f'throughput: {result["ops_per_sec"]:.0f} ops/s')
+        for op in OPERATIONS:
+            latency = result['latency'][op]
+            self.stdout.write(f'{op + ":":<11} ' + ' '.join(
+                f'{p}={latency[p] * 1000:.3f}ms'
+                for p in ('p50', 'p90', 'p99', 'max')))
+        if not result['correct']:
+            raise CommandError('Increments were lost: the cache does not '
+                               'support atomic increment')
+        self.stdout.write(self.style.SUCCESS('OK'))
@@ -1,18 +1,122 @@
+import re
+import time
+
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 
+from django_ratelimit import ALL
+from django_ratelimit.adaptive import monitor
+from django_ratelimit.core import compile_concurrency_limit, compile_limit
 from django_ratelimit.exceptions import Ratelimited
+from django_ratelimit.penalty import PenaltyBox
+from django_ratelimit.priority import PriorityShedder
+
+
+class Rule:
+    """
+    One entry of RATELIMIT_MIDDLEWARE_RULES, compiled when the middleware
+    is created.
+    """
+    __slots__ = ('path', 'block', 'limit', 'concurrency')
+
+    def __init__(self, path=None, group=None, key=None, rate=None,
+                 concurrency=None, method=ALL, cost=1, quota=False,
+                 penalty=None, count_if=None, timeout=60, block=True):
+        if (rate is None) == (concurrency is None):
+            raise ImproperlyConfigured(
+                'Ratelimit middleware rules need exactly one of `rate` or '
+                '`concurrency`')
+        if group is None:
+            group = 'middleware:%s' % (path or '')
+        self.path = None if path is None else re.compile(path)
+        self.block = block
+        self.limit = None
+        self.concurrency = None
+        if isinstance(penalty, dict):
+            penalty = PenaltyBox(**penalty)
+        if rate is not None:
+            self.limit = compile_limit(group=group, key=key, rate=rate,
+                                       method=method, cost=cost,
+                                       quota=quota, penalty=penalty,
+                                       count_if=count_if)
+        else:
+            self.concurrency = compile_concurrency_limit(
+                group=group, key=key, limit=concurrency, timeout=timeout,
+                method=method)
+
+    def matches(self, request):
+        return self.path is None or self.path.match(request.path_info)
 
 
 class RatelimitMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        self.rules = [
+            Rule(**rule)
+            for rule in getattr(settings, 'RATELIMIT_MIDDLEWARE_RULES', ())
+        ]
+        self.shedder = None
+        priority_rate = getattr(settings, 'RATELIMIT_PRIORITY_RATE', None)
+        if priority_rate is not None:
+            self.shedder = PriorityShedder(
+                priority_rate,
+                getattr(settings, 'RATELIMIT_PRIORITY_CLASSES', ()))
+        if getattr(settings, 'RATELIMIT_PRECOMPILE', False):
+            # Django creates middleware once, when the handler is loaded,
+            # after every app is ready and before any request is handled.
+            from django_ratelimit.warmup import precompile
+            precompile()
 
     def __call__(self, request):
-        return self.get_response(request)
+        monitor.request_started()
+        start = time.perf_counter()
+        try:
+            return self.handle(request)
+        finally:
+            monitor.request_finished(time.perf_counter() - start)
+
+    def handle(self, request):
+        if self.shedder is not None and not self.shedder.admit(request):
+            request.limited = True
+            return self.ratelimited(request, Ratelimited())
+
+        if not self.rules:
+            return self.get_response(request)
+
+        slots = []
+        count_after = []
+        try:
+            for rule in self.rules:
+                if not rule.matches(request):
+                    continue
+                if rule.limit is not None and rule.limit.count_if is not None:
+                    limited = rule.limit.is_exhausted(request)
+                    count_after.append(rule.limit)
+                elif rule.limit is not None:
+                    limited = rule.limit.is_ratelimited(request,
+                                                        increment=True)
+                else:
+                    slot = rule.concurrency.acquire(request)
+                    slots.append((rule.concurrency, slot))
+                    limited = slot is False
+                request.limited = limited or getattr(request, 'limited',
+                                                     False)
+                if limited and rule.block:
+                    return self.ratelimited(request, Ratelimited())
+            response = self.get_response(request)
+            for limit in count_after:
+                limit.count_response(request, response)
+            return response
+        finally:
+            for concurrency, slot in slots:
+                concurrency.release(slot)
+
+    def ratelimited(self, request, exception):
+        view = import_string(settings.RATELIMIT_VIEW)
+        return view(request, exception)
 
     def process_exception(self, request, exception):
         if not isinstance(exception, Ratelimited):
             return None
-        view = import_string(settings.RATELIMIT_VIEW)
-        return view(request, exception)
+        return self.ratelimited(request, exception)
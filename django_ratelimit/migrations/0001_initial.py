@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Quota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True, serialize=False,
+                                           verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('group', models.CharField(max_length=255)),
+                ('value', models.TextField(blank=True)),
+                ('window', models.BigIntegerField(db_index=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
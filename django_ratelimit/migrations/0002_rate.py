@@ -0,0 +1,28 @@
+import django_ratelimit.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratelimit', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True, serialize=False,
+                                           verbose_name='ID')),
+                ('group', models.CharField(max_length=255)),
+                ('value', models.CharField(blank=True, max_length=255)),
+                ('rate', models.CharField(
+                    max_length=32,
+                    validators=[django_ratelimit.models.validate_rate])),
+            ],
+            options={
+                'unique_together': {('group', 'value')},
+            },
+        ),
+    ]
@@ -1 +1,44 @@
-# This module intentionally left blank.
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from django_ratelimit.core import _RATE_PATTERN, _split_rate
+
+
+def validate_rate(value):
+    if not re.fullmatch(_RATE_PATTERN, value) or _split_rate(value)[1] <= 0:
+        raise ValidationError('%(value)s is not a valid rate',
+                              params={'value': value})
+
+
+class Quota(models.Model):
+    """
+    The durable count for one window of a quota limit. Written in bulk by
+    django_ratelimit.quota, and read when the cache has lost the count.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    group = models.CharField(max_length=255)
+    value = models.TextField(blank=True)
+    window = models.BigIntegerField(db_index=True)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '%s %s: %d' % (self.group, self.value, self.count)
+
+
+class Rate(models.Model):
+    """
+    The rate for a group and key value, read by
+    django_ratelimit.rates.RateTable. An empty value sets the rate for the
+    rest of the group.
+    """
+    group = models.CharField(max_length=255)
+    value = models.CharField(max_length=255, blank=True)
+    rate = models.CharField(max_length=32, validators=[validate_rate])
+
+    class Meta:
+        unique_together = [('group', 'value')]
+
+    def __str__(self):
+        return '%s %s: %s' % (self.group, self.value or '*', self.rate)
@@ -0,0 +1,95 @@
+"""
+Penalty boxes: bans for keys that keep going over a limit, growing longer
+each time, so that a banned client costs one cache read instead of a full
+count.
+"""
+import socket
+
+from django_ratelimit.core import EXPIRATION_FUDGE, _hash_key
+
+
+__all__ = ['PenaltyBox']
+
+
+class PenaltyBox:
+    """
+    Bans a key for ``ban`` seconds once it has gone over a limit in
+    ``strikes`` windows, and for ``factor`` times longer with every further
+    strike, up to ``max_ban`` seconds. Strikes are forgotten ``forget``
+    seconds after the last one.
+
+    With ``local=True``, bans are also remembered in this process, for up
+    to ``local_size`` keys, so that checking a banned key costs nothing.
+    """
+    def __init__(self, strikes=3, ban=60, factor=2, max_ban=24 * 60 * 60,
+                 forget=24 * 60 * 60, local=False, local_size=10000):
+        self.strikes = strikes
+        self.ban = ban
+        self.factor = factor
+        self.max_ban = max_ban
+        self.forget = forget
+        self.local = local
+        self.local_size = local_size
+        self._local = {}
+
+    def __repr__(self):
+        return '<PenaltyBox strikes=%r ban=%r max_ban=%r>' % (
+            self.strikes, self.ban, self.max_ban)
+
+    def _remember(self, ban_key, until, now):
+        if len(self._local) >= self.local_size:
+            self._local = {k: v for k, v in self._local.items() if v > now}
+            if len(self._local) >= self.local_size:
+                self._local = {}
+        self._local[ban_key] = until
+
+    def banned_until(self, cache, group, value, now):
+        """
+        Return when the key's ban ends, or None if it isn't banned.
+        """
+        ban_key = _hash_key([group, 'penalty:ban', value])
+        if self.local:
+            until = self._local.get(ban_key)
+            if until is not None:
+                if until > now:
+                    return until
+                self._local.pop(ban_key, None)
+        try:
+            until = cache.get(ban_key)
+        except socket.gaierror:  # for redis
+            return None
+        if until is None or until <= now:
+            return None
+        if self.local:
+            self._remember(ban_key, until, now)
+        return until
+
+    def strike(self, cache, group, value, now):
+        """
+        Record that the key went over its limit in this window, and ban it
+        if that was one strike too many. Returns when the ban ends, or None.
+        """
+        strikes_key = _hash_key([group, 'penalty:strikes', value])
+        try:
+            if cache.add(strikes_key, 1, self.forget):
+                strikes = 1
+            else:
+                strikes = cache.incr(strikes_key)
+                cache.touch(strikes_key, self.forget)
+        except (socket.gaierror, ValueError):
+            return None
+        if strikes is None or strikes < self.strikes:
+            return None
+
+        escalation = min(strikes - self.strikes, 64)
+        duration = int(min(self.ban * self.factor ** escalation,
+                           self.max_ban))
+        until = now + duration
+        ban_key = _hash_key([group, 'penalty:ban', value])
+        try:
+            cache.set(ban_key, until, duration + EXPIRATION_FUDGE)
+        except socket.gaierror:  # for redis
+            return None
+        if self.local:
+            self._remember(ban_key, until, now)
+        return until
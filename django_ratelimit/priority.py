@@ -0,0 +1,138 @@
+"""
+Priority classes for RatelimitMiddleware: when the global budget runs low,
+lower priority requests are turned away first.
+"""
+import re
+import socket
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from django_ratelimit import ALL
+from django_ratelimit.core import (EXPIRATION_FUDGE, NETWORK_ALLOW,
+                                   compile_limit, _get_network_rule,
+                                   _compile_methods, _get_now, _get_window,
+                                   _get_session_user_id, _hash_key,
+                                   _split_rate)
+
+
+__all__ = ['PriorityClass', 'PriorityShedder']
+
+
+class PriorityClass:
+    """
+    One entry of RATELIMIT_PRIORITY_CLASSES. A request belongs to the first
+    class whose conditions all match it.
+    """
+    __slots__ = ('name', 'share', 'path', 'methods', 'headers',
+                 'authenticated', 'limit')
+
+    def __init__(self, name, share=1.0, path=None, method=ALL, header=None,
+                 authenticated=None, rate=None):
+        if share is not None and not 0 <= share <= 1:
+            raise ImproperlyConfigured(
+                'Priority class share must be between 0 and 1')
+        self.name = name
+        self.share = share
+        self.path = None if path is None else re.compile(path)
+        self.methods = _compile_methods(method)
+        if isinstance(header, str):
+            header = [header]
+        if not isinstance(header, dict):
+            header = dict.fromkeys(header or ())
+        self.headers = tuple(
+            ('HTTP_' + h.replace('-', '_').upper(), value)
+            for h, value in header.items())
+        self.authenticated = authenticated
+        self.limit = None
+        if rate is not None:
+            self.limit = compile_limit(group='priority:%s' % name,
+                                       key=lambda group, request: '',
+                                       rate=rate)
+
+    def __repr__(self):
+        return '<PriorityClass %s>' % self.name
+
+    def matches(self, request):
+        if self.path is not None and not self.path.match(request.path_info):
+            return False
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        import hmac
+
+        for header, value in self.headers:
+            sent = request.META.get(header)
+            if sent is None:
+                return False
+            if value is not None and not hmac.compare_digest(
+                    sent.encode(), value.encode()):
+                return False
+        if self.authenticated is not None:
+            user_id = _get_session_user_id(request)
+            if (user_id is not None) != self.authenticated:
+                return False
+        return True
+
+
+class PriorityShedder:
+    """
+    Counts admitted requests against a global rate. A request is admitted
+    while the count is within its class's ``share`` of the limit, and
+    within the class's own ``rate``, if it has one. Classes with a share of
+    None are never shed, and not counted.
+    """
+    def __init__(self, rate, classes):
+        self.limit, self.period = _split_rate(rate)
+        self.classes = [PriorityClass(**c) for c in classes]
+
+    def classify(self, request):
+        for priority_class in self.classes:
+            if priority_class.matches(request):
+                return priority_class
+        return None
+
+    def admit(self, request):
+        priority_class = self.classify(request)
+        request.ratelimit_priority = priority_class
+        if not getattr(settings, 'RATELIMIT_ENABLE', True):
+            return True
+        if priority_class is None or priority_class.share is None:
+            return True
+        if _get_network_rule(request) is NETWORK_ALLOW:
+            return True
+
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+        cache = caches[cache_name]
+        window = _get_window('', self.period, _get_now(request))
+        cache_key = _hash_key(
+            ['priority', '%d/%ds' % (self.limit, self.period), str(window)])
+
+        try:
+            added = cache.add(cache_key, 1, self.period + EXPIRATION_FUDGE)
+        except socket.gaierror:  # for redis
+            added = False
+        count = None
+        if added:
+            count = 1
+        else:
+            try:
+                count = cache.incr(cache_key)
+            except ValueError:
+                pass
+        if count is None or count is False:
+            return getattr(settings, 'RATELIMIT_FAIL_OPEN', False)
+
+        # Only admitted requests count against the budget, so a flood of
+        # low priority requests can't push out higher ones, and only
+        # requests within the budget count against their class's rate.
+        admitted = count <= self.limit * priority_class.share
+        if admitted and priority_class.limit is not None:
+            admitted = not priority_class.limit.is_ratelimited(
+                request, increment=True)
+        if not admitted:
+            try:
+                cache.decr(cache_key)
+            except (socket.gaierror, ValueError):
+                pass
+        return admitted
@@ -0,0 +1,102 @@
+"""
+Check that the ratelimit cache counts correctly when incremented from many
+threads at once, and measure the operations get_usage sends it. Used by the
+RATELIMIT_PROBE_CACHE deploy check and the ratelimit_bench command.
+"""
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_ratelimit.core import EXPIRATION_FUDGE, _hash_key
+
+
+__all__ = ['probe_cache', 'percentile']
+
+OPERATIONS = ('add', 'incr', 'get')
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not samples:
+        return 0.0
+    return samples[max(math.ceil(p / 100 * len(samples)) - 1, 0)]
+
+
+def probe_cache(cache_name=None, threads=8, ops=100):
+    """
+    Increment one counter ``ops`` times from each of ``threads`` threads,
+    the way get_usage does, and read it after every increment.
+
+    Returns a dict with the number of increments sent (``expected``), the
+    final ``count``, whether they match (``correct``), ``ops_per_sec``, and
+    the 50th, 90th and 99th percentile and maximum ``latency`` of each
+    operation, in seconds. Errors from the cache are raised.
+    """
+    if cache_name is None:
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+    key = _hash_key(['probe', uuid.uuid4().hex])
+    timings = {op: [] for op in OPERATIONS}
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        cache = caches[cache_name]
+        samples = {op: [] for op in OPERATIONS}
+        try:
+            barrier.wait()
+            for _ in range(ops):
+                start = time.perf_counter()
+                added = cache.add(key, 1, 60 + EXPIRATION_FUDGE)
+                samples['add'].append(time.perf_counter() - start)
+                if not added:
+                    start = time.perf_counter()
+                    cache.incr(key, 1)
+                    samples['incr'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                cache.get(key)
+                samples['get'].append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+        finally:
+            cache.close()
+            with lock:
+                for op in OPERATIONS:
+                    timings[op].extend(samples[op])
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+
+    cache = caches[cache_name]
+    count = cache.get(key)
+    cache.delete(key)
+
+    latency = {}
+    for op in OPERATIONS:
+        samples = sorted(timings[op])
+        latency[op] = {
+            'p50': percentile(samples, 50),
+            'p90': percentile(samples, 90),
+            'p99': percentile(samples, 99),
+            'max': samples[-1] if samples else 0.0,
+        }
+    expected = threads * ops
+    return {
+        'expected': expected,
+        'count': count,
+        'correct': count == expected,
+        'ops_per_sec': sum(map(len, timings.values())) / elapsed,
+        'latency': latency,
+    }
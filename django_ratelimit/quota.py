@@ -0,0 +1,158 @@
+"""
+Quotas: long-period limits whose counts are kept in the database as well
+as the cache, so that an eviction or restart doesn't reset them.
+
+The cache serves every read and increment. Increments are also collected
+in memory and written to the database in bulk, at most every
+RATELIMIT_QUOTA_FLUSH_INTERVAL seconds. When the cache has lost a count,
+it is seeded again from the database.
+"""
+import atexit
+import collections
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from django_ratelimit.core import _get_now
+from django_ratelimit.models import Quota
+
+
+__all__ = ['QuotaBuffer', 'buffer', 'flush', 'clear_expired']
+
+
+class QuotaBuffer:
+    """
+    Increments waiting to be written to the database, by cache key.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def add(self, key, group, value, window, n):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [group, value, window, n]
+            else:
+                entry[3] += n
+        interval = getattr(settings, 'RATELIMIT_QUOTA_FLUSH_INTERVAL', 10)
+        if time.monotonic() - self._flushed < interval:
+            return
+        using = Quota.objects.db
+        if transaction.get_connection(using).in_atomic_block:
+            # Written in the request's transaction, e.g. with
+            # ATOMIC_REQUESTS, the increments would be lost if it rolled
+            # back. Wait for it to commit; if it doesn't, they are kept for
+            # the next flush.
+            self._flushed = time.monotonic()
+            transaction.on_commit(self._flush_quietly, using=using)
+        else:
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except DatabaseError:
+            # The increments are kept for the next flush.
+            pass
+
+    def pending(self, key):
+        entry = self._pending.get(key)
+        return 0 if entry is None else entry[3]
+
+    def flush(self):
+        """
+        Write every pending increment to the database. If that fails, they
+        are kept for the next flush and the error is raised. Call it outside
+        any transaction, or they are lost if the transaction rolls back.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        try:
+            _write(pending)
+        except Exception:
+            with self._lock:
+                for key, (group, value, window, n) in pending.items():
+                    entry = self._pending.setdefault(
+                        key, [group, value, window, 0])
+                    entry[3] += n
+            raise
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+
+def _write(pending):
+    # One UPDATE for every distinct increment, rather than one per key.
+    keys_by_n = collections.defaultdict(list)
+    for key, (group, value, window, n) in pending.items():
+        keys_by_n[n].append(key)
+    with transaction.atomic(using=Quota.objects.db):
+        Quota.objects.bulk_create([
+            Quota(key=key, group=group, value=value, window=window)
+            for key, (group, value, window, n) in pending.items()
+        ], ignore_conflicts=True)
+        for n, keys in keys_by_n.items():
+            Quota.objects.filter(key__in=keys).update(count=F('count') + n)
+
+
+buffer = QuotaBuffer()
+flush = buffer.flush
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        pass
+
+
+def _load(key):
+    stored = Quota.objects.filter(key=key).values_list('count', flat=True)
+    return (stored.first() or 0) + buffer.pending(key)
+
+
+def get_count(cache, key, group, value, window, timeout, increment, cost):
+    """
+    Return the count for a quota's window, adding ``cost`` to it if
+    ``increment``, or None if the cache or database failed.
+    """
+    try:
+        if increment:
+            try:
+                count = cache.incr(key, cost)
+            except ValueError:
+                # Missing, or the cache is unavailable.
+                count = None
+        else:
+            count = cache.get(key)
+        if count is None:
+            count = _load(key) + (cost if increment else 0)
+            if not cache.add(key, count, timeout):
+                # Another process seeded the count first.
+                if increment:
+                    count = cache.incr(key, cost)
+                else:
+                    count = cache.get(key)
+    except (socket.gaierror, ValueError, DatabaseError):
+        return None
+    if increment and count is not None and count is not False:
+        buffer.add(key, group, value, window, cost)
+    return count
+
+
+def clear_expired(now=None):
+    """Delete the stored counts of windows that have ended."""
+    if now is None:
+        now = _get_now()
+    return Quota.objects.filter(window__lt=now).delete()[0]
@@ -0,0 +1,114 @@
+"""
+Rates kept in the database, in the Rate model, so that they can be changed
+from the admin without a deploy.
+"""
+import socket
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from django_ratelimit.core import _compile_key, _hash_key
+from django_ratelimit.models import Rate
+
+
+__all__ = ['RateTable', 'invalidate']
+
+# Bumped whenever this process changes a Rate, so that its own tables are
+# reloaded at once, rather than after the next generation check.
+_local_generation = 0
+
+
+def _generation_key():
+    return _hash_key(['ratetable:generation'])
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RATELIMIT_USE_CACHE', 'default')]
+
+
+def invalidate():
+    """
+    Make every RateTable, in every process, reload its rates. Called when a
+    Rate is saved or deleted, once the transaction commits; call it after
+    changing rates in bulk.
+    """
+    global _local_generation
+    _local_generation += 1
+    cache = _get_cache()
+    key = _generation_key()
+    try:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+    except (socket.gaierror, ValueError):
+        # Other processes catch up when the cache is back, or restarts.
+        pass
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def _rate_changed(sender, **kwargs):
+    # Other processes can't see the change until then, and would reload
+    # the old rates.
+    transaction.on_commit(invalidate)
+
+
+class RateTable:
+    """
+    A rate callable that looks up the rate for the group and key value in
+    the Rate model, falling back to the group's row with an empty value,
+    then to ``default``.
+
+    Each group's rates are loaded in one query, and kept until a Rate is
+    changed. Other processes notice the change within ``interval``
+    seconds, by reading a generation counter from the cache.
+    """
+    def __init__(self, key=None, default=None, interval=5):
+        self.key = key
+        self.default = default
+        self.interval = interval
+        self._key = None if key is None else _compile_key(key)
+        self._tables = {}
+        self._generation = None
+        self._local_generation = _local_generation
+        self._checked = None
+
+    def __repr__(self):
+        return '<RateTable key=%r default=%r>' % (self.key, self.default)
+
+    def _check_generation(self):
+        if self._local_generation != _local_generation:
+            self._local_generation = _local_generation
+            self._tables = {}
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.interval:
+            return
+        self._checked = now
+        try:
+            generation = _get_cache().get(_generation_key(), 0)
+        except socket.gaierror:  # for redis
+            return
+        if generation != self._generation:
+            self._generation = generation
+            self._tables = {}
+
+    def get_table(self, group):
+        """Return a dict of key value to rate for the group."""
+        self._check_generation()
+        table = self._tables.get(group)
+        if table is None:
+            table = dict(Rate.objects.filter(group=group)
+                         .values_list('value', 'rate'))
+            self._tables[group] = table
+        return table
+
+    def __call__(self, group, request):
+        table = self.get_table(group)
+        if self._key is not None and table:
+            rate = table.get(self._key(group, request))
+            if rate is not None:
+                return rate
+        return table.get('', self.default)
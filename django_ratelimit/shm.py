@@ -0,0 +1,198 @@
+"""
+A cache backend that keeps counters in a memory-mapped file, shared by
+every worker process on one host, for deployments that don't need to
+share counts between hosts. Only stores integers. Unix only.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+__all__ = ['SharedMemoryCache']
+
+# Each slot is a 16 byte digest of the key, when it expires (0 for
+# never), and the value. An all-zero digest marks an empty slot.
+SLOT = struct.Struct('<16sdq')
+EMPTY = bytes(16)
+# Keys are only looked for in the bucket of slots their digest picks.
+BUCKET_SIZE = 8
+
+_regions = {}
+_regions_lock = threading.Lock()
+
+
+class _Region:
+    """
+    The mapped file, and the locks for each stripe of buckets. A stripe is
+    locked with a thread lock, against other threads, then a lock on one
+    byte of the file, against other processes.
+    """
+    def __init__(self, path, slots, stripes):
+        self.buckets = -(-slots // BUCKET_SIZE)
+        self.stripes = stripes
+        size = self.buckets * BUCKET_SIZE * SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.pid = os.getpid()
+
+    def lock(self, stripe):
+        self.locks[stripe].acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+
+    def unlock(self, stripe):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+        self.locks[stripe].release()
+
+
+def _get_region(path, slots, stripes):
+    with _regions_lock:
+        region = _regions.get(path)
+        # Locks and file locks don't survive a fork, so map it again.
+        if region is None or region.pid != os.getpid():
+            region = _regions[path] = _Region(path, slots, stripes)
+        return region
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    Stores integers in fixed-size slots of the file at LOCATION. Supports
+    these OPTIONS:
+
+    SLOTS
+        How many keys fit in the file. Defaults to 65536, which takes 2MiB.
+        When a key's bucket is full, the key that expires first is evicted.
+    STRIPES
+        How many locks the slots are split between. Defaults to 64.
+
+    Every process using the same LOCATION must use the same OPTIONS.
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._region = _get_region(location, options.get('SLOTS', 65536),
+                                   options.get('STRIPES', 64))
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        bucket = int.from_bytes(digest[:8], 'little') % self._region.buckets
+        return digest, bucket
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    def _find(self, digest, bucket, now):
+        """
+        Return the offset of the key's slot, or None, and of the slot to
+        store it in if it's missing: an empty or expired one, or else the
+        one that expires first.
+        """
+        region = self._region
+        start = bucket * BUCKET_SIZE * SLOT.size
+        free = victim = None
+        victim_expires = None
+        for offset in range(start, start + BUCKET_SIZE * SLOT.size,
+                            SLOT.size):
+            slot_digest, expires, _ = SLOT.unpack_from(region.map, offset)
+            live = slot_digest != EMPTY and (not expires or expires > now)
+            if not live:
+                if free is None:
+                    free = offset
+            elif slot_digest == digest:
+                return offset, None
+            elif expires and (victim is None or expires < victim_expires):
+                victim, victim_expires = offset, expires
+        if free is None:
+            # Keys that never expire are only evicted by each other.
+            free = victim if victim is not None else start
+        return None, free
+
+    def _update(self, key, version, fn):
+        digest, bucket = self._locate(key, version)
+        stripe = bucket % self._region.stripes
+        self._region.lock(stripe)
+        try:
+            found, free = self._find(digest, bucket, time.time())
+            return fn(digest, found, free)
+        finally:
+            self._region.unlock(stripe)
+
+    def _write(self, offset, digest, expires, value):
+        if not isinstance(value, int):
+            raise TypeError('SharedMemoryCache only stores integers')
+        SLOT.pack_into(self._region.map, offset, digest, expires, value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        def add(digest, found, free):
+            if found is not None:
+                return False
+            self._write(free, digest, self._expires(timeout), value)
+            return True
+        return self._update(key, version, add)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        def set_(digest, found, free):
+            offset = free if found is None else found
+            self._write(offset, digest, self._expires(timeout), value)
+        self._update(key, version, set_)
+
+    def get(self, key, default=None, version=None):
+        def get(digest, found, free):
+            if found is None:
+                return default
+            return SLOT.unpack_from(self._region.map, found)[2]
+        return self._update(key, version, get)
+
+    def incr(self, key, delta=1, version=None):
+        def incr(digest, found, free):
+            if found is None:
+                raise ValueError("Key '%s' not found" % key)
+            _, expires, value = SLOT.unpack_from(self._region.map, found)
+            self._write(found, digest, expires, value + delta)
+            return value + delta
+        return self._update(key, version, incr)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        def touch(digest, found, free):
+            if found is None:
+                return False
+            value = SLOT.unpack_from(self._region.map, found)[2]
+            self._write(found, digest, self._expires(timeout), value)
+            return True
+        return self._update(key, version, touch)
+
+    def delete(self, key, version=None):
+        def delete(digest, found, free):
+            if found is None:
+                return False
+            SLOT.pack_into(self._region.map, found, EMPTY, 0.0, 0)
+            return True
+        return self._update(key, version, delete)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        region = self._region
+        for stripe in range(region.stripes):
+            region.lock(stripe)
+        try:
+            region.map[:] = bytes(len(region.map))
+        finally:
+            for stripe in range(region.stripes):
+                region.unlock(stripe)
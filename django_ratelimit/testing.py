@@ -0,0 +1,305 @@
+"""
+In-process stand-ins for the cache backends django_ratelimit supports,
+for exercising rate limits under concurrency without a real server, and
+helpers for testing rate-limited views.
+"""
+import contextlib
+import random
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+from django_ratelimit import ALL
+from django_ratelimit.core import _get_clock, get_usage
+
+
+__all__ = ['FakeServer', 'FakeServerManager', 'FakeRedisCache',
+           'FakeMemcachedCache', 'TestCache', 'FakeClock', 'fake_clock',
+           'reset', 'get_count']
+
+
+class FakeServer:
+    """
+    A key-value store with the atomic add and incr semantics of redis and
+    memcached. Every operation holds a single lock, like a single-threaded
+    server would. Keys expire by ``clock``, which defaults to time.time.
+    """
+    def __init__(self, clock=time.time):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def _get(self, key, now):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def add(self, key, value, expires):
+        with self._lock:
+            if self._get(key, self._clock()) is not None:
+                return False
+            self._data[key] = (value, expires)
+            return True
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def get_many(self, keys):
+        now = self._clock()
+        with self._lock:
+            items = ((key, self._get(key, now)) for key in keys)
+            return {key: item[0] for key, item in items if item is not None}
+
+    def incr(self, key, delta):
+        with self._lock:
+            item = self._get(key, self._clock())
+            if item is None:
+                return None
+            value = item[0] + delta
+            self._data[key] = (value, item[1])
+            return value
+
+    def touch(self, key, expires):
+        with self._lock:
+            item = self._get(key, self._clock())
+            if item is None:
+                return False
+            self._data[key] = (item[0], expires)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+_manager_server = FakeServer()
+
+
+def _get_manager_server():
+    return _manager_server
+
+
+class FakeServerManager(BaseManager):
+    """
+    Serves a single FakeServer to other processes, e.g.:
+
+        manager = FakeServerManager(address=('127.0.0.1', 0))
+        manager.start()
+
+    and set the cache's ADDRESS option to manager.address.
+    """
+
+
+FakeServerManager.register('get_server', callable=_get_manager_server)
+
+
+class FakeCache(BaseCache):
+    """
+    Base class for the fake backends. Supports these OPTIONS:
+
+    LATENCY
+        Seconds to sleep before every operation, to simulate a network
+        round trip.
+    FAILURE_RATE
+        The probability, from 0 to 1, that an operation fails the way the
+        real backend does when the server is unavailable.
+    ADDRESS, AUTHKEY
+        The address of a FakeServerManager, to share counts between
+        processes. Without an address, caches with the same LOCATION share
+        counts within the process.
+    """
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._latency = options.get('LATENCY', 0)
+        self._failure_rate = options.get('FAILURE_RATE', 0)
+        address = options.get('ADDRESS')
+        if address:
+            manager = FakeServerManager(address=tuple(address),
+                                        authkey=options.get('AUTHKEY'))
+            manager.connect()
+            self._server = manager.get_server()
+        else:
+            with _servers_lock:
+                self._server = _servers.get(server)
+                if self._server is None:
+                    self._server = _servers[server] = FakeServer(self._now)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _now(self):
+        return time.time()
+
+    def _expires(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return self._now() + timeout
+
+    def _round_trip(self):
+        """Wait for the simulated network, return False on a failure."""
+        if self._latency:
+            time.sleep(self._latency)
+        return random.random() >= self._failure_rate
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if not self._round_trip():
+            return self._failed_add()
+        return self._server.add(key, value, self._expires(timeout))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        if not self._round_trip():
+            return default
+        return self._server.get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not self._round_trip():
+            return {}
+        values = self._server.get_many(list(keys))
+        return {keys[key]: value for key, value in values.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if self._round_trip():
+            self._server.set(key, value, self._expires(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if not self._round_trip():
+            return False
+        return self._server.touch(key, self._expires(timeout))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        if not self._round_trip():
+            return self._failed_incr(key)
+        value = self._server.incr(key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        if not self._round_trip():
+            return False
+        return self._server.delete(key)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        self._server.clear()
+
+
+class FakeRedisCache(FakeCache):
+    """
+    Fails like django_redis with IGNORE_EXCEPTIONS: every operation returns
+    None, so add() reports the key was not added and incr() returns None.
+    """
+    def _failed_add(self):
+        return None
+
+    def _failed_incr(self, key):
+        return None
+
+
+class FakeMemcachedCache(FakeCache):
+    """
+    Fails like pymemcache: add() returns False and incr() raises
+    ValueError.
+    """
+    def _failed_add(self):
+        return False
+
+    def _failed_incr(self, key):
+        raise ValueError("Key '%s' not found" % key)
+
+
+class TestCache(FakeCache):
+    """
+    A fast, in-memory cache for test suites, with no latency or failures,
+    where keys expire by RATELIMIT_CLOCK, so that moving a FakeClock past
+    the end of a window resets its counts.
+    """
+    # Not a test case, for pytest, which collects Test* classes.
+    __test__ = False
+
+    def _now(self):
+        return _get_clock()()
+
+    def _failed_add(self):
+        return False
+
+    def _failed_incr(self, key):
+        raise ValueError("Key '%s' not found" % key)
+
+
+class FakeClock:
+    """
+    A clock for RATELIMIT_CLOCK that only moves when told to. Every request
+    reads the clock once, so move it between requests, not during one.
+    """
+    def __init__(self, now=1700000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds=1):
+        self.now += seconds
+        return self.now
+
+
+@contextlib.contextmanager
+def fake_clock(now=1700000000):
+    """
+    Use a new FakeClock for RATELIMIT_CLOCK, and return it:
+
+        with fake_clock() as clock:
+            ...
+            clock.advance(60)
+    """
+    from django.test.utils import override_settings
+
+    clock = FakeClock(now)
+    with override_settings(RATELIMIT_CLOCK=clock):
+        yield clock
+
+
+def reset(cache_name=None):
+    """Forget every count, by clearing the ratelimit cache."""
+    if cache_name is None:
+        cache_name = getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+    caches[cache_name].clear()
+
+
+def get_count(request, group=None, fn=None, key=None, rate=None,
+              method=ALL):
+    """
+    Return the count of the limit for the request, without incrementing
+    it, or None if the limit doesn't apply to it.
+    """
+    usage = get_usage(request, group, fn, key, rate, method)
+    if usage is None:
+        return None
+    return usage['count']
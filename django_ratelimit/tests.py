@@ -1,16 +1,48 @@
+import asyncio
+import subprocess
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
 from functools import partial
-
-from django.core.cache import cache, InvalidCacheBackendError
-from django.core.exceptions import ImproperlyConfigured
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches, InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse
 from django.test import RequestFactory, TestCase
 from django.test.utils import override_settings
+from django.urls import include, path
 from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import View
 
-from django_ratelimit.decorators import ratelimit
+from django_ratelimit import ALL, quota, rates, shm, testing, warmup
+from django_ratelimit.checks import check_cache_probe
+from django_ratelimit.adaptive import AdaptiveRate, LoadMonitor, monitor
+from django_ratelimit.batching import CounterBatcher, _apply
+from django_ratelimit.broadcast import (LocalBroadcast, RedisBroadcast,
+                                        load_broadcast)
+from django_ratelimit.decorators import concurrencylimit, ratelimit
 from django_ratelimit.exceptions import Ratelimited
+from django_ratelimit.middleware import RatelimitMiddleware
+from django_ratelimit.models import Quota, Rate, validate_rate
+from django_ratelimit.penalty import PenaltyBox
+from django_ratelimit.probe import probe_cache
 from django_ratelimit.core import (get_usage, is_ratelimited,
-                                   _split_rate, _get_ip)
+                                   peek_usage_many, coarse_time, compile_limit,
+                                   compile_concurrency_limit,
+                                   get_key_footprint, _split_rate, _get_ip,
+                                   _get_window, _make_cache_key,
+                                   _compile_networks)
 
 
 rf = RequestFactory()
@@ -48,6 +80,14 @@ def mykey(group, request):
     return request.META['REMOTE_ADDR'][::-1]
 
 
+def failed(request, response):
+    return response.status_code >= 400
+
+
+def double_cost(group, request):
+    return 2
+
+
 class CustomRatelimitedException(Exception):
     pass
 
@@ -166,6 +206,52 @@ class RatelimitTests(TestCase):
         assert not view(_req())
         assert view(_req())
 
+    def test_composite_key(self):
+        def _req(ip, agent):
+            req = rf.get('/', HTTP_USER_AGENT=agent)
+            req.META['REMOTE_ADDR'] = ip
+            return req
+
+        @ratelimit(key=('ip', 'header:user-agent'), rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(_req('1.2.3.4', 'a'))
+        assert view(_req('1.2.3.4', 'a'))
+        assert not view(_req('1.2.3.4', 'b'))
+        assert not view(_req('5.6.7.8', 'a'))
+        assert view(_req('5.6.7.8', 'a'))
+
+    def test_composite_key_callables(self):
+        @ratelimit(key=['get:a', mykey, 'django_ratelimit.tests.mykey'],
+                   rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.get('/', {'a': '1'}))
+        assert view(rf.get('/', {'a': '1'}))
+        assert not view(rf.get('/', {'a': '2'}))
+
+    def test_composite_key_value(self):
+        req = rf.get('/', {'a': 'x'}, HTTP_USER_AGENT='ua')
+        limit = compile_limit(group='g', rate='1/m',
+                              key=('ip', 'get:a', 'header:user-agent'))
+        assert limit._key('g', req) == '9:127.0.0.1\x1f1:x\x1f2:ua'
+
+    def test_composite_key_separator_in_value(self):
+        limit = compile_limit(group='g', rate='1/m', key=('get:a', 'get:b'))
+        one = limit._key('g', rf.get('/', {'a': 'x\x1fy', 'b': 'z'}))
+        other = limit._key('g', rf.get('/', {'a': 'x', 'b': 'y\x1fz'}))
+        assert one != other
+
+    def test_composite_key_unknown_part(self):
+        @ratelimit(key=('ip', 'nope:x'), rate='1/m')
+        def view(request):
+            return True
+
+        with self.assertRaises(ImproperlyConfigured):
+            view(rf.get('/'))
+
     def test_rate(self):
         @ratelimit(key='ip', rate='2/m', block=False)
         def twice(request):
@@ -288,6 +374,96 @@ class RatelimitTests(TestCase):
         assert not view(_req(auth=True))
         assert view(_req(auth=True))
 
+    def test_user_id(self):
+        def _req(user_id=None):
+            req = rf.post('/')
+            req.session = {}
+            if user_id is not None:
+                req.session['_auth_user_id'] = user_id
+            return req
+
+        @ratelimit(key='user_id', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(_req(user_id=1))
+        assert view(_req(user_id=1))
+        assert not view(_req(user_id=2))
+
+    def test_user_id_does_not_load_user(self):
+        class ExplodingRequest:
+            META = {'REMOTE_ADDR': '1.2.3.4'}
+            method = 'GET'
+            session = {'_auth_user_id': '7'}
+
+            @property
+            def user(self):
+                raise AssertionError('request.user should not be loaded')
+
+        usage = get_usage(ExplodingRequest(), group='a', key='user_id',
+                          rate='1/m', increment=True)
+        assert usage['count'] == 1
+
+    def test_user_id_or_ip(self):
+        def _req(user_id=None):
+            req = rf.post('/')
+            req.session = {}
+            if user_id is not None:
+                req.session['_auth_user_id'] = str(user_id)
+            return req
+
+        @ratelimit(key='user_id_or_ip', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(_req())
+        assert view(_req())
+        assert not view(_req(user_id=1))
+        assert view(_req(user_id=1))
+
+    def test_user_id_or_ip_matches_user_or_ip(self):
+        req = rf.post('/')
+        req.session = {'_auth_user_id': '1'}
+        req.user = MockUser(authenticated=True)
+        get_usage(req, group='a', key='user_or_ip', rate='1/m',
+                  increment=True)
+
+        req = rf.post('/')
+        req.session = {'_auth_user_id': '1'}
+        usage = get_usage(req, group='a', key='user_id_or_ip', rate='1/m')
+        assert usage['count'] == 1
+
+    def test_key_cookie(self):
+        @ratelimit(key='cookie:token', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        rf.cookies['token'] = 'a'
+        try:
+            assert not view(rf.get('/'))
+            assert view(rf.get('/'))
+            rf.cookies['token'] = 'b'
+            assert not view(rf.get('/'))
+        finally:
+            del rf.cookies['token']
+
+    def test_key_signed_cookie(self):
+        @ratelimit(key='signed_cookie:token', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        def _req(value):
+            req = rf.get('/')
+            req.COOKIES['token'] = value
+            return req
+
+        signed = signing.get_cookie_signer(salt='token').sign('a')
+        assert not view(_req(signed))
+        assert view(_req(signed))
+        # A forged cookie falls back to the shared, empty value.
+        assert not view(_req('a:forged'))
+        assert view(_req('b:forged'))
+
     def test_callable_key_path(self):
         @ratelimit(key='django_ratelimit.tests.mykey', rate='1/m', block=False)
         def view(request):
@@ -411,6 +587,45 @@ class RatelimitTests(TestCase):
             req.META['REMOTE_ADDR'] = '2001:db9::1000'
             assert not view(req)
 
+    def test_cost(self):
+        @ratelimit(key='ip', rate='10/m', cost=4, block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.post('/')), 'Count is 4.'
+        assert not view(rf.post('/')), 'Count is 8.'
+        assert view(rf.post('/')), 'Count is 12, limited.'
+
+    def test_callable_cost(self):
+        def get_cost(group, request):
+            return len(request.POST.getlist('item'))
+
+        @ratelimit(key='ip', rate='3/m', cost=get_cost, block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.post('/', {'item': ['a', 'b']}))
+        assert not view(rf.post('/', {'item': ['c']}))
+        assert view(rf.post('/', {'item': ['d']}))
+
+    def test_callable_cost_import(self):
+        @ratelimit(key='ip', rate='4/m', block=False,
+                   cost='django_ratelimit.tests.double_cost')
+        def view(request):
+            return request.limited
+
+        assert not view(rf.post('/'))
+        assert not view(rf.post('/'))
+        assert view(rf.post('/'))
+
+    def test_bad_cost(self):
+        @ratelimit(key='ip', rate='1/m', cost=-1)
+        def view(request):
+            return True
+
+        with self.assertRaises(ImproperlyConfigured):
+            view(rf.post('/'))
+
 
 class FunctionsTests(TestCase):
     def setUp(self):
@@ -471,11 +686,1538 @@ class FunctionsTests(TestCase):
         self.assertLessEqual(usage['time_left'], 60)
         self.assertTrue(usage['should_limit'])
 
+    def test_get_usage_without_increment_does_not_write(self):
+        with patch.object(cache, 'add') as add, \
+                patch.object(cache, 'incr') as incr:
+            usage = get_usage(rf.get('/'), group='a', key='ip', rate='1/m')
+        add.assert_not_called()
+        incr.assert_not_called()
+        self.assertEqual(usage['count'], 0)
+
+        get_usage(rf.get('/'), group='a', key='ip', rate='1/m',
+                  increment=True)
+        usage = get_usage(rf.get('/'), group='a', key='ip', rate='1/m')
+        self.assertEqual(usage['count'], 1)
+
+    def test_get_usage_cost(self):
+        _get_usage = partial(get_usage, method=get_usage.ALL, key='ip',
+                             rate='10/m', group='a')
+        _get_usage(rf.get('/'), increment=True, cost=3)
+        usage = _get_usage(rf.get('/'), increment=True, cost=5)
+        self.assertEqual(usage['count'], 8)
+        self.assertFalse(usage['should_limit'])
+
+        usage = _get_usage(rf.get('/'), cost=5)
+        self.assertEqual(usage['count'], 8)
+
+    def test_peek_usage_many(self):
+        def _req(ip):
+            req = rf.get('/')
+            req.META['REMOTE_ADDR'] = ip
+            return req
+
+        _get_usage = partial(get_usage, method=get_usage.ALL, key='ip',
+                             rate='1/m', group='a', increment=True)
+        _get_usage(_req('1.2.3.4'))
+        _get_usage(_req('1.2.3.4'))
+        _get_usage(_req('5.6.7.8'))
+
+        usages = peek_usage_many('a', '1/m', ['1.2.3.4', '5.6.7.8', '9.9.9.9'])
+        self.assertEqual(usages['1.2.3.4']['count'], 2)
+        self.assertTrue(usages['1.2.3.4']['should_limit'])
+        self.assertEqual(usages['5.6.7.8']['count'], 1)
+        self.assertFalse(usages['5.6.7.8']['should_limit'])
+        self.assertEqual(usages['9.9.9.9']['count'], 0)
+        self.assertLessEqual(usages['9.9.9.9']['time_left'], 60)
+
+    def test_peek_usage_many_does_not_write(self):
+        with patch.object(cache, 'add') as add, \
+                patch.object(cache, 'set') as set_:
+            peek_usage_many('a', '1/m', ['1.2.3.4', '5.6.7.8'])
+        add.assert_not_called()
+        set_.assert_not_called()
+
+    def test_peek_usage_many_rates(self):
+        for rate in (lambda g, r: '1/m', 'django_ratelimit.tests.mykey',
+                     AdaptiveRate(lambda g, r: '1/m'), None):
+            with self.assertRaisesRegex(ImproperlyConfigured, 'fixed rate'):
+                peek_usage_many('a', rate, ['1.2.3.4'])
+        with self.assertRaisesRegex(ImproperlyConfigured, 'Invalid'):
+            peek_usage_many('a', 'nope', ['1.2.3.4'])
+        with self.assertRaisesRegex(ImproperlyConfigured, 'period'):
+            peek_usage_many('a', '1/0m', ['1.2.3.4'])
+
+    def test_peek_usage_many_adaptive(self):
+        get_usage(rf.get('/'), group='a', key='ip', rate='10/m',
+                  increment=True)
+        rate = AdaptiveRate('10/m')
+        rate.factor = 0.5
+        usage = peek_usage_many('a', rate, ['127.0.0.1'])['127.0.0.1']
+        assert (usage['count'], usage['limit']) == (1, 5), usage
+
+    @override_settings(RATELIMIT_ENABLE=False)
+    def test_peek_usage_many_disabled(self):
+        self.assertEqual(peek_usage_many('a', '1/m', ['1.2.3.4']),
+                         {'1.2.3.4': None})
+
+    def test_compile_limit(self):
+        limit = compile_limit(group='a', key='ip', rate='1/m')
+        assert not limit.is_ratelimited(rf.get('/'), increment=True)
+        assert limit.is_ratelimited(rf.get('/'), increment=True)
+
+        usage = get_usage(rf.get('/'), group='a', key='ip', rate='1/m')
+        self.assertEqual(usage, limit.get_usage(rf.get('/')))
+
+    def test_compile_limit_does_not_parse_per_request(self):
+        limit = compile_limit(group='a', key='header:x-api-key', rate='5/m',
+                              method=['get', 'post'])
+        with patch('django_ratelimit.core._split_rate') as split_rate, \
+                patch('django_ratelimit.core._compile_key') as compile_key:
+            usage = limit.get_usage(rf.get('/'), increment=True)
+        split_rate.assert_not_called()
+        compile_key.assert_not_called()
+        self.assertEqual(usage['count'], 1)
+        self.assertIsNone(limit.get_usage(rf.put('/')))
+
+    def test_compile_limit_group_from_fn(self):
+        def view(request):
+            pass
+
+        limit = compile_limit(fn=view, key='ip', rate='1/m')
+        self.assertEqual(
+            limit.group,
+            'django_ratelimit.tests.FunctionsTests.'
+            'test_compile_limit_group_from_fn.<locals>.view')
+
+    def test_compile_limit_errors_on_use(self):
+        limit = compile_limit(group='a', key='nope:x', rate='1/m')
+        with self.assertRaises(ImproperlyConfigured):
+            limit.get_usage(rf.get('/'))
+
+        with self.assertRaises(ImproperlyConfigured):
+            compile_limit(key='ip', rate='1/m')
+
     def test_get_usage_called_without_group_or_fn(self):
         with self.assertRaises(ImproperlyConfigured):
             get_usage(rf.get('/'), key='ip')
 
 
+class CacheKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _key(self):
+        return _make_cache_key('a', 1000, '1/m', '1.2.3.4', ALL)
+
+    def test_default(self):
+        key = self._key()
+        assert key.startswith('rl:')
+        assert len(key) == 3 + 64
+
+    @override_settings(RATELIMIT_KEY_ENCODING='base85')
+    def test_base85(self):
+        assert len(self._key()) == 3 + 40
+
+    @override_settings(RATELIMIT_KEY_ENCODING='base64',
+                       RATELIMIT_KEY_DIGEST_SIZE=12)
+    def test_base64_truncated(self):
+        assert len(self._key()) == 3 + 16
+
+    @override_settings(RATELIMIT_KEY_DIGEST_SIZE=16)
+    def test_hex_truncated(self):
+        key = self._key()
+        assert len(key) == 3 + 32
+        with self.settings(RATELIMIT_KEY_DIGEST_SIZE=None):
+            assert self._key().startswith(key)
+
+    @override_settings(RATELIMIT_KEY_DIGEST_SIZE=4)
+    def test_digest_too_short(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self._key()
+
+    @override_settings(RATELIMIT_KEY_ENCODING='rot13')
+    def test_bad_encoding(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self._key()
+
+    @override_settings(RATELIMIT_KEY_ENCODING='base85',
+                       RATELIMIT_KEY_DIGEST_SIZE=16)
+    def test_compact_keys_count(self):
+        @ratelimit(key='ip', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.get('/'))
+        assert view(rf.get('/'))
+
+    def test_footprint(self):
+        footprint = get_key_footprint(limit=100)
+        # ':1:' from the cache's key function, 'rl:' and the hex digest.
+        assert footprint['key_bytes'] == 3 + 3 + 64
+        assert footprint['value_bytes'] == 3
+        assert footprint['total_bytes'] == sum([
+            footprint['key_bytes'],
+            footprint['value_bytes'],
+            footprint['overhead_bytes'],
+        ])
+
+        with self.settings(RATELIMIT_KEY_ENCODING='base85',
+                           RATELIMIT_KEY_DIGEST_SIZE=16):
+            compact = get_key_footprint(limit=100)
+        assert compact['key_bytes'] == 3 + 3 + 20
+
+
+class StepClock:
+    def __init__(self, now=1000):
+        self.now = now
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.now
+
+
+class ClockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_window(self):
+        assert _get_window('a', 1, now=1000) == 1000
+        window = _get_window('a', 60, now=1000)
+        assert 1000 <= window < 1060
+        assert _get_window('a', 60, now=window) == window
+        assert _get_window('a', 60, now=window + 1) == window + 60
+
+    def test_injected_clock(self):
+        clock = StepClock()
+        _get_usage = partial(get_usage, group='a', key='ip', rate='1/m',
+                             increment=True)
+        with self.settings(RATELIMIT_CLOCK=clock):
+            usage = _get_usage(rf.get('/'))
+            assert not usage['should_limit']
+            assert usage['time_left'] == _get_window('127.0.0.1', 60,
+                                                     1000) - 1000
+
+            clock.now += usage['time_left']
+            assert _get_usage(rf.get('/'))['should_limit']
+
+            clock.now += 1
+            assert not _get_usage(rf.get('/'))['should_limit']
+
+    def test_clock_snapshot_per_request(self):
+        clock = StepClock()
+
+        @ratelimit(key='ip', rate='5/m', block=False)
+        @ratelimit(key='ip', rate='10/h', block=False)
+        @ratelimit(key='ip', rate='100/d', block=False)
+        def view(request):
+            return request.limited
+
+        with self.settings(RATELIMIT_CLOCK=clock):
+            view(rf.get('/'))
+        assert clock.calls == 1
+
+    @override_settings(RATELIMIT_CLOCK='django_ratelimit.core.coarse_time')
+    def test_coarse_clock(self):
+        @ratelimit(key='ip', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.get('/'))
+        assert view(rf.get('/'))
+        assert abs(coarse_time() - time.time()) < 1
+
+
+class ConcurrencyLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrency(self):
+        @concurrencylimit(key='ip', limit=2, block=False)
+        def view(request, depth):
+            if depth:
+                return [request.limited] + view(rf.get('/'), depth - 1)
+            return [request.limited]
+
+        assert view(rf.get('/'), 1) == [False, False]
+        assert view(rf.get('/'), 2) == [False, False, True]
+        # Slots are given back once the views return.
+        assert view(rf.get('/'), 1) == [False, False]
+
+    def test_block(self):
+        @concurrencylimit(key='ip', limit=1)
+        def view(request, nested):
+            if nested:
+                view(rf.get('/'), False)
+            return True
+
+        assert view(rf.get('/'), False)
+        with self.assertRaises(Ratelimited):
+            view(rf.get('/'), True)
+        assert view(rf.get('/'), False)
+
+    def test_released_on_exception(self):
+        @concurrencylimit(key='ip', limit=1)
+        def view(request):
+            raise ValueError()
+
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                view(rf.get('/'))
+
+    def test_zero(self):
+        @concurrencylimit(key='ip', limit=0, block=False)
+        def view(request):
+            return request.limited
+
+        assert view(rf.get('/'))
+
+    def test_keys_and_methods_separate(self):
+        limit = compile_concurrency_limit(group='a', key='get:k', limit=1,
+                                          method='POST')
+        lease = limit.acquire(rf.post('/?k=a'))
+        assert isinstance(lease, tuple)
+        assert limit.acquire(rf.post('/?k=a')) is False
+        assert limit.acquire(rf.get('/?k=a')) is True
+        other = limit.acquire(rf.post('/?k=b'))
+        assert isinstance(other, tuple)
+        limit.release(lease)
+        limit.release(other)
+        assert isinstance(limit.acquire(rf.post('/?k=a')), tuple)
+
+    def test_leases_expire(self):
+        limit = compile_concurrency_limit(group='a', key='ip', limit=1,
+                                          timeout=60)
+        slot, _ = limit.acquire(rf.get('/'))
+        assert limit.acquire(rf.get('/')) is False
+        # A crashed worker never releases its slot, but the lease expires.
+        cache.touch(slot, 0)
+        assert isinstance(limit.acquire(rf.get('/')), tuple)
+
+    def test_expired_lease_not_released(self):
+        limit = compile_concurrency_limit(group='a', key='ip', limit=1,
+                                          timeout=60)
+        slow = limit.acquire(rf.get('/'))
+        cache.touch(slow[0], 0)
+        lease = limit.acquire(rf.get('/'))
+        # The slow request finishes after its lease was taken over.
+        limit.release(slow)
+        assert limit.acquire(rf.get('/')) is False
+        limit.release(lease)
+        assert isinstance(limit.acquire(rf.get('/')), tuple)
+
+    async def test_async_view(self):
+        @concurrencylimit(key='ip', limit=1, block=False)
+        async def view(request, nested):
+            if nested:
+                inner = await view(rf.get('/'), False)
+                return [request.limited, inner[0]]
+            await asyncio.sleep(0)
+            return [request.limited]
+
+        assert await view(rf.get('/'), True) == [False, True]
+        # Held until the coroutine finishes, then given back.
+        assert await view(rf.get('/'), False) == [False]
+
+    @override_settings(RATELIMIT_USE_CACHE='fake-memcached-failing')
+    def test_cache_failure(self):
+        limit = compile_concurrency_limit(group='a', key='ip', limit=1)
+        assert limit.acquire(rf.get('/')) is False
+        with self.settings(RATELIMIT_FAIL_OPEN=True):
+            assert limit.acquire(rf.get('/')) is True
+
+    @override_settings(RATELIMIT_FAIL_OPEN=True)
+    def test_taken_with_fail_open(self):
+        limit = compile_concurrency_limit(group='a', key='ip', limit=1)
+        assert isinstance(limit.acquire(rf.get('/')), tuple)
+        # Taken between the read and the add.
+        with patch.object(caches['default'], 'get_many', return_value={}):
+            assert limit.acquire(rf.get('/')) is False
+
+    @override_settings(RATELIMIT_USE_CACHE='connection-errors-redis',
+                       RATELIMIT_FAIL_OPEN=True)
+    def test_cache_failure_fail_open(self):
+        limit = compile_concurrency_limit(group='a', key='ip', limit=1)
+        assert limit.acquire(rf.get('/')) is True
+
+
+def ratelimited_view(request, exception):
+    return HttpResponse(status=429)
+
+
+@override_settings(RATELIMIT_VIEW='django_ratelimit.tests.ratelimited_view')
+class MiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _middleware(self, get_response=None):
+        if get_response is None:
+            def get_response(request):
+                return HttpResponse()
+        return RatelimitMiddleware(get_response)
+
+    def test_process_exception(self):
+        mw = self._middleware()
+        response = mw.process_exception(rf.get('/'), Ratelimited())
+        assert response.status_code == 429
+        assert mw.process_exception(rf.get('/'), ValueError()) is None
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'path': r'^/api/', 'key': 'ip', 'rate': '1/m'},
+    ])
+    def test_rate_rule(self):
+        mw = self._middleware()
+        assert mw(rf.get('/api/a')).status_code == 200
+        assert mw(rf.get('/api/b')).status_code == 429
+        assert mw(rf.get('/other')).status_code == 200
+        assert mw(rf.get('/other')).status_code == 200
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'key': 'ip', 'rate': '1/m', 'block': False},
+    ])
+    def test_rate_rule_no_block(self):
+        mw = self._middleware(lambda r: HttpResponse(r.limited))
+        assert mw(rf.get('/')).content == b'False'
+        assert mw(rf.get('/')).content == b'True'
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'path': r'^/upload/', 'key': 'ip', 'concurrency': 1},
+    ])
+    def test_concurrency_rule(self):
+        responses = []
+
+        def get_response(request):
+            if request.GET.get('nested'):
+                responses.append(mw(rf.get('/upload/')))
+            return HttpResponse()
+
+        mw = self._middleware(get_response)
+        assert mw(rf.get('/upload/', {'nested': 1})).status_code == 200
+        assert responses[0].status_code == 429
+        assert mw(rf.get('/upload/')).status_code == 200
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'key': 'ip', 'rate': '1/m', 'concurrency': 1},
+    ])
+    def test_bad_rule(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self._middleware()
+
+
+class AdaptiveRateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.monitor = LoadMonitor()
+
+    def test_scales_down_and_recovers(self):
+        rate = AdaptiveRate('100/m', max_in_flight=10, interval=0,
+                            monitor=self.monitor)
+        assert rate.scale_limit(100) == 100
+
+        self.monitor.in_flight = 11
+        assert rate.scale_limit(100) == 50
+        assert rate.scale_limit(100) == 25
+        for _ in range(10):
+            rate.scale_limit(100)
+        assert rate.scale_limit(100) == 10, 'Never below min_factor'
+
+        self.monitor.in_flight = 0
+        assert rate.scale_limit(100) == 20
+        assert rate.scale_limit(100) == 30
+        for _ in range(10):
+            rate.scale_limit(100)
+        assert rate.scale_limit(100) == 100
+
+    def test_small_rate(self):
+        rate = AdaptiveRate('5/m', max_in_flight=10, interval=0,
+                            monitor=self.monitor)
+        self.monitor.in_flight = 11
+        for _ in range(10):
+            rate.scale_limit(5)
+        assert rate.factor == 0.1
+        assert rate.scale_limit(5) == 1, 'Never scaled down to nothing'
+        assert rate.scale_limit(15) == 2
+
+    def test_signals_cached(self):
+        rate = AdaptiveRate('100/m', max_p95=0.5, interval=60,
+                            monitor=self.monitor)
+        self.monitor.request_started()
+        self.monitor.request_finished(1.0)
+        assert rate.scale_limit(100) == 100
+        with patch.object(self.monitor, 'p95') as p95:
+            rate.scale_limit(100)
+        p95.assert_not_called()
+
+    def test_p95(self):
+        for i in range(100):
+            self.monitor.request_started()
+            self.monitor.request_finished(i / 100)
+        assert self.monitor.p95() == 0.94
+        assert self.monitor.in_flight == 0
+
+    def test_loop_lag(self):
+        rate = AdaptiveRate('100/m', max_loop_lag=0.1, interval=0,
+                            monitor=self.monitor)
+        self.monitor.record_loop_lag(0.2)
+        assert rate.scale_limit(100) == 50
+
+    def test_ratelimit(self):
+        rate = AdaptiveRate('4/m', max_in_flight=1, interval=0,
+                            monitor=self.monitor)
+
+        @ratelimit(key='ip', rate=rate, block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.get('/'))
+        assert not view(rf.get('/'))
+        self.monitor.in_flight = 2
+        # The limit is halved to 2, but the count carries over.
+        assert view(rf.get('/'))
+        self.monitor.in_flight = 0
+        rate.recover = 1
+        assert not view(rf.get('/'))
+        assert view(rf.get('/'))
+
+    def test_callable_rate(self):
+        rate = AdaptiveRate(lambda g, r: (10, 60), max_in_flight=0,
+                            interval=0, monitor=self.monitor)
+        self.monitor.in_flight = 1
+        usage = get_usage(rf.get('/'), group='a', key='ip', rate=rate)
+        assert usage['limit'] == 5
+
+    def test_middleware_reports_load(self):
+        seen = []
+
+        def get_response(request):
+            seen.append(monitor.in_flight)
+            return HttpResponse()
+
+        in_flight = monitor.in_flight
+        RatelimitMiddleware(get_response)(rf.get('/'))
+        assert seen == [in_flight + 1]
+        assert monitor.in_flight == in_flight
+
+
+@override_settings(
+    RATELIMIT_VIEW='django_ratelimit.tests.ratelimited_view',
+    RATELIMIT_PRIORITY_RATE='10/m',
+    RATELIMIT_PRIORITY_CLASSES=[
+        {'name': 'health', 'path': r'^/health', 'share': None},
+        {'name': 'internal', 'header': {'x-internal': 's3cret'},
+         'share': 1.0},
+        {'name': 'mobile', 'header': 'x-app-version', 'share': 0.5},
+        {'name': 'authenticated', 'authenticated': True, 'share': 0.8},
+        {'name': 'anonymous', 'share': 0.5, 'rate': '100/m'},
+    ],
+)
+class PriorityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.mw = RatelimitMiddleware(
+            lambda r: HttpResponse(r.ratelimit_priority.name))
+
+    def _req(self, path='/', auth=False, **extra):
+        req = rf.get(path, **extra)
+        req.session = {'_auth_user_id': '1'} if auth else {}
+        return req
+
+    def test_classify(self):
+        classify = self.mw.shedder.classify
+        assert classify(self._req('/health')).name == 'health'
+        assert classify(
+            self._req(HTTP_X_INTERNAL='s3cret')).name == 'internal'
+        assert classify(self._req(HTTP_X_INTERNAL='x')).name == 'anonymous'
+        assert classify(self._req(HTTP_X_APP_VERSION='2')).name == 'mobile'
+        assert classify(self._req(auth=True)).name == 'authenticated'
+        assert classify(self._req()).name == 'anonymous'
+
+    def test_low_priority_shed_first(self):
+        statuses = [self.mw(self._req()).status_code for _ in range(10)]
+        assert statuses == [200] * 5 + [429] * 5, statuses
+
+        # Rejected requests don't use up the budget.
+        statuses = [self.mw(self._req(auth=True)).status_code
+                    for _ in range(5)]
+        assert statuses == [200] * 3 + [429] * 2, statuses
+
+        statuses = [self.mw(self._req(HTTP_X_INTERNAL='s3cret')).status_code
+                    for _ in range(3)]
+        assert statuses == [200, 200, 429], statuses
+
+        # Health checks are never shed.
+        assert self.mw(self._req('/health')).status_code == 200
+
+    @override_settings(RATELIMIT_ALLOW_NETWORKS=['10.0.0.0/8'])
+    def test_allowed_network(self):
+        statuses = [self.mw(self._req(REMOTE_ADDR='10.1.2.3')).status_code
+                    for _ in range(10)]
+        assert statuses == [200] * 10, statuses
+        assert self.mw(self._req()).status_code == 200
+
+    @override_settings(RATELIMIT_ENABLE=False)
+    def test_disabled(self):
+        statuses = [self.mw(self._req()).status_code for _ in range(10)]
+        assert statuses == [200] * 10, statuses
+
+    @override_settings(RATELIMIT_PRIORITY_CLASSES=[
+        {'name': 'anonymous', 'rate': '2/m'},
+    ])
+    def test_class_rate(self):
+        mw = RatelimitMiddleware(lambda r: HttpResponse())
+        statuses = [mw(self._req()).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+
+    @override_settings(RATELIMIT_PRIORITY_CLASSES=[
+        {'name': 'anonymous', 'share': 0.5, 'rate': '6/m'},
+    ])
+    def test_shed_requests_not_counted_by_class(self):
+        mw = RatelimitMiddleware(lambda r: HttpResponse())
+        statuses = [mw(self._req()).status_code for _ in range(8)]
+        assert statuses == [200] * 5 + [429] * 3, statuses
+        usage = get_usage(self._req(), group='priority:anonymous',
+                          key=lambda group, request: '', rate='6/m')
+        assert usage['count'] == 5, usage
+
+    def test_cache_failure(self):
+        mw = RatelimitMiddleware(lambda r: HttpResponse())
+        with patch.object(cache, 'add', side_effect=socket.gaierror):
+            assert mw(self._req()).status_code == 429
+            with self.settings(RATELIMIT_FAIL_OPEN=True):
+                assert mw(self._req()).status_code == 200
+
+    @override_settings(RATELIMIT_PRIORITY_CLASSES=[
+        {'name': 'api', 'path': '^/api/'},
+    ])
+    def test_unclassified(self):
+        mw = RatelimitMiddleware(lambda r: HttpResponse())
+        for _ in range(15):
+            assert mw(self._req('/other/')).status_code == 200
+
+    @override_settings(RATELIMIT_PRIORITY_CLASSES=[
+        {'name': 'anonymous', 'share': 2},
+    ])
+    def test_bad_share(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RatelimitMiddleware(lambda r: HttpResponse())
+
+
+class QuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        quota.buffer.clear()
+
+    def tearDown(self):
+        quota.buffer.clear()
+
+    def _view(self, rate='3/30d'):
+        @ratelimit(group='quota', key='ip', rate=rate, quota=True)
+        def view(request):
+            return True
+        return view
+
+    def test_flush(self):
+        view = self._view('10/30d')
+        for ip in ('1.2.3.4', '1.2.3.4', '5.6.7.8'):
+            assert view(rf.get('/', REMOTE_ADDR=ip))
+        assert Quota.objects.count() == 0
+
+        # One INSERT and one UPDATE for each distinct increment.
+        with self.assertNumQueries(5):
+            quota.flush()
+        counts = dict(Quota.objects.values_list('value', 'count'))
+        assert counts == {'1.2.3.4': 2, '5.6.7.8': 1}, counts
+
+        assert view(rf.get('/', REMOTE_ADDR='1.2.3.4'))
+        quota.flush()
+        assert Quota.objects.get(value='1.2.3.4').count == 3
+
+    def test_survives_cache_loss(self):
+        view = self._view()
+        for _ in range(2):
+            assert view(rf.get('/'))
+        quota.flush()
+        cache.clear()
+
+        assert view(rf.get('/'))
+        with self.assertRaises(Ratelimited):
+            view(rf.get('/'))
+
+    def test_unflushed_count_survives_cache_loss(self):
+        view = self._view()
+        for _ in range(3):
+            assert view(rf.get('/'))
+        cache.clear()
+        with self.assertRaises(Ratelimited):
+            view(rf.get('/'))
+
+    def test_read_only(self):
+        view = self._view()
+        view(rf.get('/'))
+        quota.flush()
+        cache.clear()
+        usage = get_usage(rf.get('/'), group='quota', key='ip',
+                          rate='3/30d', quota=True)
+        assert usage['count'] == 1
+
+    @override_settings(RATELIMIT_QUOTA_FLUSH_INTERVAL=0)
+    def test_flush_interval(self):
+        # Tests run in a transaction, like views with ATOMIC_REQUESTS.
+        with self.captureOnCommitCallbacks(execute=True):
+            self._view()(rf.get('/'))
+        assert Quota.objects.get().count == 1
+
+    @override_settings(RATELIMIT_QUOTA_FLUSH_INTERVAL=0)
+    def test_flush_rolled_back(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self._view()(rf.get('/'))
+                    raise ValueError()
+        assert Quota.objects.count() == 0
+        quota.flush()
+        assert Quota.objects.get().count == 1
+
+    def test_failed_flush_is_kept(self):
+        self._view()(rf.get('/'))
+        with patch('django_ratelimit.quota._write',
+                   side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                quota.flush()
+        quota.flush()
+        assert Quota.objects.get().count == 1
+
+    @override_settings(RATELIMIT_USE_CACHE='fake-memcached-failing')
+    def test_cache_failure(self):
+        with self.assertRaises(Ratelimited):
+            self._view()(rf.get('/'))
+        quota.flush()
+        assert Quota.objects.count() == 0
+
+    def test_clear_expired(self):
+        Quota.objects.create(key='old', group='g', window=100, count=1)
+        Quota.objects.create(key='new', group='g', window=300, count=1)
+        assert quota.clear_expired(now=200) == 1
+        assert list(Quota.objects.values_list('key', flat=True)) == ['new']
+
+
+class PenaltyBoxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = StepClock()
+
+    def _over_limit(self, view):
+        """Go over the limit in a new window, and return the last usage."""
+        self.clock.now += 60
+        view(rf.get('/'))
+        return view(rf.get('/'))
+
+    def _view(self, penalty):
+        def view(request):
+            return get_usage(request, group='penalty', key='ip',
+                             rate='1/m', increment=True, penalty=penalty)
+        return view
+
+    def test_escalation(self):
+        view = self._view(PenaltyBox(strikes=2, ban=100, factor=2))
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            assert self._over_limit(view)['should_limit']
+            # One strike isn't enough for a ban.
+            self.clock.now += 60
+            assert not view(rf.get('/'))['should_limit']
+
+            assert self._over_limit(view)['should_limit']
+            usage = view(rf.get('/'))
+            assert usage['should_limit']
+            assert usage['time_left'] == 100
+            self.clock.now += 100
+            assert not view(rf.get('/'))['should_limit']
+
+            # The next strike doubles the ban.
+            view(rf.get('/'))
+            assert view(rf.get('/'))['time_left'] == 200
+
+    def test_max_ban(self):
+        view = self._view(PenaltyBox(strikes=1, ban=100, factor=10,
+                                     max_ban=500))
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            self._over_limit(view)
+            self.clock.now += 100
+            self._over_limit(view)
+            assert view(rf.get('/'))['time_left'] == 500
+
+    def test_banned_costs_one_get(self):
+        view = self._view(PenaltyBox(strikes=1))
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            self._over_limit(view)
+            backend = caches['default']
+            with patch.object(backend, 'get', wraps=backend.get) as get, \
+                    patch.object(backend, 'incr') as incr, \
+                    patch.object(backend, 'add') as add:
+                assert view(rf.get('/'))['should_limit']
+            assert get.call_count == 1
+            incr.assert_not_called()
+            add.assert_not_called()
+
+    def test_local(self):
+        view = self._view(PenaltyBox(strikes=1, ban=60, local=True))
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            self._over_limit(view)
+            with patch.object(caches['default'], 'get') as get:
+                assert view(rf.get('/'))['should_limit']
+            get.assert_not_called()
+
+            self.clock.now += 60
+            assert not view(rf.get('/'))['should_limit']
+
+    def test_read_only(self):
+        penalty = PenaltyBox(strikes=1)
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            self._over_limit(self._view(penalty))
+            assert is_ratelimited(rf.get('/'), group='penalty', key='ip',
+                                  rate='100/m', penalty=penalty)
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'key': 'ip', 'rate': '1/m', 'penalty': {'strikes': 1, 'ban': 600}},
+    ], RATELIMIT_VIEW='django_ratelimit.tests.ratelimited_view')
+    def test_middleware(self):
+        mw = RatelimitMiddleware(lambda r: HttpResponse())
+        assert isinstance(mw.rules[0].limit.penalty, PenaltyBox)
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            statuses = [mw(rf.get('/')).status_code for _ in range(2)]
+            self.clock.now += 120
+            statuses.append(mw(rf.get('/')).status_code)
+        assert statuses == [200, 429, 429]
+
+
+class CountIfTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _view(self, **kw):
+        @ratelimit(key='ip', rate='2/m', count_if=failed, **kw)
+        def view(request):
+            return HttpResponse(status=int(request.GET.get('status', 200)))
+        return view
+
+    def test_only_failures_counted(self):
+        view = self._view()
+        backend = caches['default']
+        with patch.object(backend, 'add') as add, \
+                patch.object(backend, 'incr') as incr:
+            for _ in range(5):
+                assert view(rf.get('/')).status_code == 200
+        add.assert_not_called()
+        incr.assert_not_called()
+
+        for _ in range(2):
+            assert view(rf.get('/', {'status': 401})).status_code == 401
+        with self.assertRaises(Ratelimited):
+            view(rf.get('/'))
+
+    def test_no_block(self):
+        view = self._view(block=False)
+        for _ in range(2):
+            req = rf.get('/', {'status': 403})
+            view(req)
+            assert not req.limited
+        req = rf.get('/', {'status': 403})
+        view(req)
+        assert req.limited
+
+    def test_dotted_path(self):
+        view = self._view(group='count-if')
+        view(rf.get('/', {'status': 500}))
+        limit = compile_limit(group='count-if', key='ip', rate='2/m',
+                              count_if='django_ratelimit.tests.failed')
+        assert limit.check() == []
+        limit.count_response(rf.get('/'), HttpResponse(status=429))
+        assert limit.is_exhausted(rf.get('/'))
+
+    def test_bad_count_if(self):
+        limit = compile_limit(group='count-if', key='ip', rate='2/m',
+                              count_if=401)
+        assert limit.check()
+
+    @override_settings(RATELIMIT_MIDDLEWARE_RULES=[
+        {'path': r'^/login/', 'key': 'ip', 'rate': '1/m',
+         'count_if': 'django_ratelimit.tests.failed'},
+    ], RATELIMIT_VIEW='django_ratelimit.tests.ratelimited_view')
+    def test_middleware(self):
+        mw = RatelimitMiddleware(
+            lambda r: HttpResponse(status=int(r.GET.get('status', 200))))
+        statuses = [mw(rf.get('/login/')).status_code for _ in range(3)]
+        statuses.append(mw(rf.get('/login/', {'status': 401})).status_code)
+        statuses.append(mw(rf.get('/login/')).status_code)
+        assert statuses == [200, 200, 200, 401, 429], statuses
+
+
+class RateTableTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Rate.objects.create(group='plans', value='1.2.3.4', rate='100/m')
+        Rate.objects.create(group='plans', value='', rate='10/m')
+
+    def test_lookup(self):
+        table = rates.RateTable(key='ip', default='1/m')
+        assert table('plans', rf.get('/', REMOTE_ADDR='1.2.3.4')) == '100/m'
+        assert table('plans', rf.get('/', REMOTE_ADDR='5.6.7.8')) == '10/m'
+        assert table('other', rf.get('/')) == '1/m'
+        assert rates.RateTable()('other', rf.get('/')) is None
+
+    def test_cached(self):
+        table = rates.RateTable(key='ip')
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                table('plans', rf.get('/'))
+
+    def test_reload_on_save(self):
+        table = rates.RateTable(key='ip', interval=60)
+        req = rf.get('/', REMOTE_ADDR='1.2.3.4')
+        assert table('plans', req) == '100/m'
+        with self.captureOnCommitCallbacks(execute=True):
+            Rate.objects.filter(value='1.2.3.4').get().delete()
+        assert table('plans', req) == '10/m'
+
+    def test_reload_after_commit(self):
+        table = rates.RateTable(key='ip', interval=60)
+        req = rf.get('/', REMOTE_ADDR='1.2.3.4')
+        assert table('plans', req) == '100/m'
+        with self.captureOnCommitCallbacks() as callbacks:
+            Rate.objects.filter(value='1.2.3.4').update(rate='200/m')
+            Rate.objects.get(value='1.2.3.4').save()
+            assert table('plans', req) == '100/m', 'Not committed yet'
+        assert len(callbacks) == 1
+        callbacks[0]()
+        assert table('plans', req) == '200/m'
+
+    def test_generation(self):
+        table = rates.RateTable(key='ip', interval=0)
+        req = rf.get('/', REMOTE_ADDR='1.2.3.4')
+        assert table('plans', req) == '100/m'
+        # Another process changes a rate.
+        Rate.objects.filter(value='1.2.3.4').update(rate='200/m')
+        assert table('plans', req) == '100/m'
+        cache.set(rates._generation_key(), 100)
+        assert table('plans', req) == '200/m'
+
+    def test_interval(self):
+        table = rates.RateTable(key='ip', interval=60)
+        table('plans', rf.get('/'))
+        with self.assertNumQueries(0), \
+                patch.object(caches['default'], 'get') as get:
+            table('plans', rf.get('/'))
+        get.assert_not_called()
+
+    def test_decorator(self):
+        @ratelimit(key='ip', rate=rates.RateTable(key='ip'), group='plans')
+        def view(request):
+            return request.limited
+
+        for _ in range(10):
+            view(rf.get('/', REMOTE_ADDR='5.6.7.8'))
+        with self.assertRaises(Ratelimited):
+            view(rf.get('/', REMOTE_ADDR='5.6.7.8'))
+        assert not view(rf.get('/', REMOTE_ADDR='1.2.3.4'))
+
+    def test_validate_rate(self):
+        validate_rate('10/5m')
+        for value in ('10', 'abc', '10/5x', '10/0s'):
+            with self.assertRaises(ValidationError):
+                validate_rate(value)
+
+
+def lossy_incr(self, key, delta=1, version=None):
+    return 1
+
+
+class ProbeTests(TestCase):
+    def test_probe(self):
+        result = probe_cache(threads=4, ops=50)
+        assert result['correct']
+        assert result['count'] == result['expected'] == 200
+        assert result['latency']['get']['p50'] > 0
+        assert result['ops_per_sec'] > 0
+
+    def test_probe_lost_increments(self):
+        with patch.object(LocMemCache, 'incr', lossy_incr):
+            result = probe_cache(threads=4, ops=50)
+        assert not result['correct']
+
+    def test_check_off(self):
+        with patch('django_ratelimit.probe.probe_cache') as probe:
+            assert check_cache_probe(None) == []
+        probe.assert_not_called()
+
+    @override_settings(RATELIMIT_PROBE_CACHE=True)
+    def test_check(self):
+        assert check_cache_probe(None) == []
+        with patch.object(LocMemCache, 'incr', lossy_incr):
+            errors = check_cache_probe(None)
+        assert [e.id for e in errors] == ['django_ratelimit.E005']
+
+    @override_settings(RATELIMIT_PROBE_CACHE=True,
+                       RATELIMIT_USE_CACHE='fake-memcached-failing')
+    def test_check_unavailable(self):
+        errors = check_cache_probe(None)
+        assert [e.id for e in errors] == ['django_ratelimit.E004']
+
+    @override_settings(RATELIMIT_PROBE_CACHE=True,
+                       RATELIMIT_PROBE_MAX_LATENCY=0)
+    def test_check_slow(self):
+        errors = check_cache_probe(None)
+        assert [e.id for e in errors] == ['django_ratelimit.W002']
+
+    def test_command(self):
+        out = StringIO()
+        call_command('ratelimit_bench', '--ops=20', stdout=out)
+        output = out.getvalue()
+        assert 'increments: 160 of 160' in output
+        assert 'OK' in output
+
+        with patch.object(LocMemCache, 'incr', lossy_incr):
+            with self.assertRaises(CommandError):
+                call_command('ratelimit_bench', '--ops=20', stdout=out)
+        with self.assertRaises(CommandError):
+            call_command('ratelimit_bench', '--cache=nope', stdout=out)
+
+
+class FakePipeline:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kw: self.calls.append((name, args, kw))
+
+    def execute(self):
+        return [True, 3] * (len(self.calls) // 2)
+
+
+class BatchingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_batch(self):
+        batcher = CounterBatcher(window=0.01)
+        with patch('django_ratelimit.batching._apply',
+                   wraps=_apply) as apply:
+            counts = await asyncio.gather(
+                *[batcher.incr('a', 1, 60) for _ in range(4)],
+                batcher.incr('b', 2, 60),
+                batcher.incr('a', 3, 60),
+            )
+        assert counts == [1, 2, 3, 4, 2, 7], counts
+        apply.assert_called_once()
+        assert apply.call_args[0][1] == {'a': (7, 60), 'b': (2, 60)}
+
+    async def test_max_size(self):
+        batcher = CounterBatcher(window=60, max_size=2)
+        with patch('django_ratelimit.batching._apply',
+                   wraps=_apply) as apply:
+            counts = await asyncio.gather(
+                *[batcher.incr('a', 1, 60) for _ in range(4)])
+        assert counts == [1, 2, 3, 4]
+        assert apply.call_count == 2
+
+    async def test_error(self):
+        batcher = CounterBatcher()
+        with patch('django_ratelimit.batching._apply',
+                   side_effect=RuntimeError):
+            assert await batcher.incr('a', 1, 60) is None
+
+    @override_settings(RATELIMIT_USE_CACHE='connection-errors-redis')
+    async def test_async_view_pipeline_failure(self):
+        @ratelimit(key='ip', rate='2/m', block=False)
+        async def view(request):
+            return request.limited
+
+        assert await view(rf.get('/'))
+        with self.settings(RATELIMIT_FAIL_OPEN=True):
+            assert not await view(rf.get('/'))
+
+    def test_pipeline(self):
+        backend = caches['connection-errors-redis']
+        pipe = FakePipeline()
+        client = type(backend.client)
+        with patch.object(client, 'get_client') as get_client:
+            get_client.return_value.pipeline.return_value = pipe
+            counts = _apply('connection-errors-redis', {'a': (3, 65)})
+        get_client.assert_called_once_with(write=True)
+        key = backend.client.make_key('a')
+        assert pipe.calls == [
+            ('set', (key, 0), {'ex': 65, 'nx': True}),
+            ('incrby', (key, 3), {}),
+        ]
+        assert counts == {'a': 3}
+
+    async def test_async_view(self):
+        @ratelimit(key='ip', rate='2/m', block=False)
+        async def view(request):
+            return request.limited
+
+        limited = await asyncio.gather(*[view(rf.get('/')) for _ in range(3)])
+        assert limited == [False, False, True]
+        usage = await view._ratelimits[0].aget_usage(rf.get('/'))
+        assert usage['count'] == 3
+
+    @override_settings(RATELIMIT_USE_CACHE='fake-memcached-failing')
+    async def test_async_view_cache_failure(self):
+        @ratelimit(key='ip', rate='2/m')
+        async def view(request):
+            return True
+
+        with self.assertRaises(Ratelimited):
+            await view(rf.get('/'))
+
+    async def test_async_lazy_user(self):
+        def get_user():
+            # Like django.contrib.auth, which reads the session's user.
+            Rate.objects.count()
+            return MockUser(authenticated=True)
+
+        @ratelimit(key='user_or_ip', rate='1/m', block=False)
+        async def view(request):
+            return request.limited
+
+        limited = []
+        for _ in range(2):
+            req = rf.get('/')
+            req.user = SimpleLazyObject(get_user)
+            limited.append(await view(req))
+        assert limited == [False, True]
+
+    async def test_async_inline_keys(self):
+        threads = []
+
+        def ip_meta(request):
+            threads.append(threading.get_ident())
+            return request.META['REMOTE_ADDR']
+
+        req = rf.get('/')
+        req.user = MockUser()
+        with self.settings(RATELIMIT_IP_META_KEY=ip_meta):
+            for key in ('ip', ('ip', 'get:q', 'header:x-api-key')):
+                limit = compile_limit(group='g', key=key, rate='1/m')
+                await limit.aget_usage(req, increment=True)
+            # The user has to be loaded, and the rate looked up.
+            for key, rate in (('user_or_ip', '1/m'),
+                              ('ip', lambda g, r: '1/m')):
+                limit = compile_limit(group='g', key=key, rate=rate)
+                await limit.aget_usage(req, increment=True)
+        loop_thread = threading.get_ident()
+        assert threads[:2] == [loop_thread] * 2
+        assert loop_thread not in threads[2:], threads
+
+    async def test_async_rate_table(self):
+        await sync_to_async(Rate.objects.create)(group='async-plans',
+                                                 value='', rate='2/m')
+
+        @ratelimit(group='async-plans', key='ip',
+                   rate=rates.RateTable(default='1/m'), block=False)
+        async def view(request):
+            return request.limited
+
+        limited = [await view(rf.get('/')) for _ in range(3)]
+        assert limited == [False, False, True]
+
+    async def test_async_count_if(self):
+        @ratelimit(key='ip', rate='1/m', count_if=failed)
+        async def view(request):
+            return HttpResponse(status=401)
+
+        assert (await view(rf.get('/'))).status_code == 401
+        with self.assertRaises(Ratelimited):
+            await view(rf.get('/'))
+
+
+class DelayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = StepClock(now=_get_window('127.0.0.1', 60, 1000) - 2)
+        self.slept = []
+        self.sleep = asyncio.sleep
+
+    async def _sleep(self, seconds):
+        self.slept.append(seconds)
+        until = self.clock.now + seconds
+        await self.sleep(0)
+        self.clock.now = max(self.clock.now, until)
+
+    async def _run(self, view, n):
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            with patch('asyncio.sleep', self._sleep):
+                return await asyncio.gather(
+                    *[view(rf.get('/')) for _ in range(n)])
+
+    async def test_delay(self):
+        @ratelimit(key='ip', rate='2/m', block=False, delay=5)
+        async def view(request):
+            return request.limited
+
+        assert await self._run(view, 4) == [False] * 4
+        # Until the first second of the next window.
+        assert self.slept == [3, 3]
+
+    async def test_too_long(self):
+        @ratelimit(key='ip', rate='2/m', block=False, delay=1)
+        async def view(request):
+            return request.limited
+
+        assert await self._run(view, 3) == [False, False, True]
+        assert self.slept == []
+
+    async def test_next_window_full(self):
+        @ratelimit(key='ip', rate='2/m', delay=5)
+        async def view(request):
+            return True
+
+        with self.assertRaises(Ratelimited):
+            await self._run(view, 5)
+        assert len(self.slept) == 2
+
+    async def test_resolves_once(self):
+        calls = []
+
+        def key(group, request):
+            # Callables may use the ORM, and run in a thread.
+            Rate.objects.count()
+            calls.append(request)
+            return 'k'
+
+        @ratelimit(key=key, rate='2/m', block=False, delay=5)
+        async def view(request):
+            return request.limited
+
+        self.clock.now = _get_window('k', 60, 1000) - 2
+        assert await self._run(view, 3) == [False] * 3
+        assert len(calls) == 3
+        assert self.slept == [3]
+
+    @override_settings(RATELIMIT_DELAY_QUEUE=1)
+    async def test_queue_depth(self):
+        @ratelimit(key='ip', rate='2/m', block=False, delay=5)
+        async def view(request):
+            return request.limited
+
+        assert await self._run(view, 4) == [False, False, False, True]
+        assert self.slept == [3]
+
+    def test_sync_view(self):
+        with self.assertRaises(ImproperlyConfigured):
+            @ratelimit(key='ip', rate='2/m', delay=5)
+            def view(request):
+                return True
+
+
+@override_settings(RATELIMIT_BROADCAST='django_ratelimit.broadcast.'
+                                       'LocalBroadcast')
+class BroadcastTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.node = load_broadcast(
+            'django_ratelimit.broadcast.LocalBroadcast')
+        self.node.clear()
+        self.other = LocalBroadcast()
+        self.other.start()
+        self.clock = StepClock()
+
+    def _usage(self):
+        return get_usage(rf.get('/'), group='broadcast', key='ip',
+                         rate='2/m', increment=True)
+
+    def test_publish(self):
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            self._usage()
+            self._usage()
+            assert self.other._limited == {}
+            usage = self._usage()
+        assert usage['should_limit']
+        [(cache_key, until)] = self.other._limited.items()
+        assert until == self.clock.now + usage['time_left']
+        assert self.node._limited == {cache_key: until}
+
+    def test_receive(self):
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            for _ in range(3):
+                self._usage()
+        self.node.clear()
+        cache.clear()
+
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            [(cache_key, until)] = self.other._limited.items()
+            self.other.publish(cache_key, until)
+            backend = caches['default']
+            with patch.object(backend, 'add') as add, \
+                    patch.object(backend, 'get') as get:
+                usage = self._usage()
+            assert usage['should_limit']
+            add.assert_not_called()
+            get.assert_not_called()
+
+            # The entry ends with the window.
+            self.clock.now = until
+            assert not self._usage()['should_limit']
+
+    def test_bounded(self):
+        node = LocalBroadcast(max_size=2)
+        with self.settings(RATELIMIT_CLOCK=self.clock):
+            node.receive(b'1001:a')
+            node.receive('999:b')
+            node.receive('1002:c')
+            assert node._limited == {'a': 1001, 'c': 1002}
+            node.receive('1003:d')
+            assert node._limited == {'d': 1003}
+
+    def test_redis(self):
+        backend = caches['connection-errors-redis']
+        node = RedisBroadcast(channel='rl',
+                              cache_name='connection-errors-redis')
+        with patch.object(type(backend.client), 'get_client') as get_client:
+            node.publish('key', 1060)
+        get_client.return_value.publish.assert_called_once_with(
+            'rl', '1060:key')
+        assert node.limited_until('key', 1000) == 1060
+
+
+@ratelimit(key='ip', rate='1/m')
+@ratelimit(key='django_ratelimit.tests.mykey', rate='10/m')
+def warm_view(request):
+    return HttpResponse()
+
+
+@concurrencylimit(key=('ip', 'get:q'), limit=2)
+def warm_concurrent_view(request):
+    return HttpResponse()
+
+
+class WarmView(View):
+    @method_decorator(ratelimit(key='user_id_or_ip', rate='5/m'))
+    def get(self, request):
+        return HttpResponse()
+
+
+urlpatterns = [
+    path('a/', warm_view),
+    path('b/', include([
+        path('c/', warm_concurrent_view),
+        path('d/', WarmView.as_view()),
+    ])),
+]
+
+
+class BadURLConf:
+    @ratelimit(key='django_ratelimit.tests.missing_key', rate='1/m')
+    @ratelimit(key=('ip', 'nope:x'), rate='1/m')
+    @ratelimit(key='ip', rate='1/0s')
+    def view(request):
+        return HttpResponse()
+
+    urlpatterns = [path('', view)]
+
+
+SHM_INCR = """
+import sys
+from django_ratelimit.shm import SharedMemoryCache
+cache = SharedMemoryCache(sys.argv[1], {})
+for _ in range(250):
+    cache.incr('counter')
+"""
+
+
+class SharedMemoryCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'ratelimit')
+        self.addCleanup(self._unmap)
+        self.cache = shm.SharedMemoryCache(self.path, {})
+
+    def _unmap(self):
+        region = shm._regions.pop(self.path, None)
+        if region is not None:
+            region.map.close()
+            os.close(region.fd)
+
+    def test_counter(self):
+        assert self.cache.add('k', 1, 60)
+        assert not self.cache.add('k', 5, 60)
+        self.assertEqual(self.cache.incr('k', 2), 3)
+        self.assertEqual(self.cache.get('k'), 3)
+        assert self.cache.delete('k')
+        assert self.cache.get('k') is None
+        with self.assertRaises(ValueError):
+            self.cache.incr('k')
+
+    def test_integers_only(self):
+        with self.assertRaises(TypeError):
+            self.cache.set('k', 'v')
+
+    def test_expiry(self):
+        self.cache.set('short', 1, 10)
+        self.cache.set('forever', 1, None)
+        with patch('time.time', return_value=time.time() + 20):
+            assert self.cache.get('short') is None
+            assert self.cache.add('short', 2, 10)
+            self.assertEqual(self.cache.get('forever'), 1)
+        assert self.cache.touch('forever', 10)
+        with patch('time.time', return_value=time.time() + 20):
+            assert self.cache.get('forever') is None
+
+    def test_evict_first_to_expire(self):
+        self._unmap()
+        cache = shm.SharedMemoryCache(self.path, {'OPTIONS': {'SLOTS': 8}})
+        for i in range(8):
+            cache.set(i, i, 60 - i)
+        cache.set('new', 1, 60)
+        assert cache.get(7) is None
+        self.assertEqual([cache.get(i) for i in range(7)], list(range(7)))
+        self.assertEqual(cache.get('new'), 1)
+
+    def test_shared_between_processes(self):
+        self.cache.set('counter', 0, 60)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        workers = [subprocess.Popen([sys.executable, '-c', SHM_INCR,
+                                     self.path], env=env)
+                   for _ in range(4)]
+        for worker in workers:
+            self.assertEqual(worker.wait(), 0)
+        self.assertEqual(self.cache.get('counter'), 1000)
+
+    def test_ratelimit(self):
+        shared = {'BACKEND': 'django_ratelimit.shm.SharedMemoryCache',
+                  'LOCATION': self.path}
+        with self.settings(CACHES={'default': shared}):
+            for _ in range(2):
+                assert not is_ratelimited(rf.get('/'), group='shm', key='ip',
+                                          rate='2/m', increment=True)
+            assert is_ratelimited(rf.get('/'), group='shm', key='ip',
+                                  rate='2/m', increment=True)
+
+
+class TestingTests(TestCase):
+    def setUp(self):
+        test_cache = {'BACKEND': 'django_ratelimit.testing.TestCache',
+                      'LOCATION': 'testing-tests'}
+        settings = self.settings(CACHES={'default': test_cache})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        testing.reset()
+
+    def _view(self):
+        @ratelimit(key='ip', rate='2/m', block=False)
+        def view(request):
+            return request.limited
+        return view
+
+    def test_window_follows_clock(self):
+        view = self._view()
+        with testing.fake_clock() as clock:
+            assert [view(rf.get('/')) for _ in range(3)] == [
+                False, False, True]
+            clock.advance(60)
+            assert not view(rf.get('/'))
+            self.assertEqual(testing.get_count(rf.get('/'), fn=view,
+                                               key='ip', rate='2/m'), 1)
+
+    def test_reset(self):
+        view = self._view()
+        with testing.fake_clock():
+            view(rf.get('/'))
+            view(rf.get('/'))
+            testing.reset()
+            assert not view(rf.get('/'))
+
+    def test_expiry_follows_clock(self):
+        with testing.fake_clock() as clock:
+            cache.set('k', 1, 10)
+            clock.advance(9)
+            self.assertEqual(cache.get('k'), 1)
+            clock.advance(1)
+            assert cache.get('k') is None
+
+    def test_get_count_no_limit(self):
+        assert testing.get_count(rf.post('/'), group='g', key='ip',
+                                 rate='1/m', method='GET') is None
+
+
+class WarmupTests(TestCase):
+    @override_settings(ROOT_URLCONF='django_ratelimit.tests')
+    def test_find_limits(self):
+        found = warmup.find_limits()
+        names = [(name.rsplit('.', 1)[-1], limit.key)
+                 for name, limit in found]
+        self.assertEqual(names, [
+            ('warm_view', 'ip'),
+            ('warm_view', 'django_ratelimit.tests.mykey'),
+            ('warm_concurrent_view', ('ip', 'get:q')),
+            ('WarmView', 'user_id_or_ip'),
+        ])
+
+    @override_settings(ROOT_URLCONF='django_ratelimit.tests')
+    def test_precompile(self):
+        with patch('django_ratelimit.core._import_string') as imp:
+            warmup.precompile()
+        imported = [c.args[0] for c in imp.call_args_list]
+        assert 'django_ratelimit.tests.mykey' in imported
+
+    @override_settings(ROOT_URLCONF=BadURLConf)
+    def test_precompile_errors(self):
+        with self.assertRaises(ImproperlyConfigured) as cm:
+            warmup.precompile()
+        message = str(cm.exception)
+        assert 'missing_key' in message
+        assert 'Unknown ratelimit key: nope:x' in message
+        assert 'period must be greater than 0' in message
+
+    @override_settings(RATELIMIT_EXCEPTION_CLASS='django_ratelimit.nope')
+    def test_precompile_bad_settings(self):
+        with self.assertRaises(ImproperlyConfigured):
+            warmup.precompile()
+
+    @override_settings(ROOT_URLCONF='django_ratelimit.tests',
+                       RATELIMIT_PRECOMPILE=True)
+    def test_middleware(self):
+        with patch('django_ratelimit.warmup.precompile') as precompile:
+            mw = RatelimitMiddleware(lambda r: HttpResponse())
+            precompile.assert_called_once_with()
+            mw(rf.get('/'))
+        precompile.assert_called_once_with()
+
+    @override_settings(ROOT_URLCONF=BadURLConf, RATELIMIT_PRECOMPILE=True)
+    def test_middleware_errors(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RatelimitMiddleware(lambda r: HttpResponse())
+
+    @override_settings(ROOT_URLCONF=BadURLConf)
+    def test_middleware_off(self):
+        RatelimitMiddleware(lambda r: HttpResponse())
+
+
+IMPORT_CHECK = """
+import sys
+import django.conf, django.core.cache, django.utils.module_loading
+before = set(sys.modules)
+import django_ratelimit.decorators, django_ratelimit.middleware
+print(' '.join(sorted(set(sys.modules) - before)))
+"""
+
+
+class ImportTests(TestCase):
+    def test_import_cost(self):
+        # Every views module using @ratelimit imports django_ratelimit, so
+        # it should only load modules that Django has already loaded.
+        out = subprocess.run([sys.executable, '-c', IMPORT_CHECK],
+                             capture_output=True, text=True, check=True)
+        added = out.stdout.split()
+        assert 'django_ratelimit.core' in added
+        extra = [m for m in added if not m.startswith('django_ratelimit')]
+        self.assertEqual(extra, [])
+
+    def test_rate_re(self):
+        from django_ratelimit.core import rate_re
+        self.assertEqual(rate_re.match('10/5m').groups(), ('10', '5', 'm'))
+
+
 class RatelimitCBVTests(TestCase):
     def setUp(self):
         cache.clear()
@@ -621,6 +2363,53 @@ class CacheFailTests(TestCase):
         assert view(rf.get('/'))
 
 
+class ConcurrencyTests(TestCase):
+    def setUp(self):
+        caches['fake-redis'].clear()
+
+    @override_settings(RATELIMIT_USE_CACHE='fake-redis')
+    def test_no_over_admission(self):
+        @ratelimit(key='ip', rate='50/m', block=False)
+        def view(request):
+            return not request.limited
+
+        admitted = []
+
+        def worker():
+            for _ in range(25):
+                if view(rf.get('/')):
+                    admitted.append(True)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(admitted) == 50
+
+    @override_settings(RATELIMIT_USE_CACHE='fake-memcached-failing')
+    def test_failing_cache_limits(self):
+        @ratelimit(key='ip', rate='10/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert view(rf.get('/'))
+
+    def test_fake_cache_expiry(self):
+        fake = testing.FakeMemcachedCache('test-fake-expiry', {})
+        fake.add('k', 1, 10)
+        fake.set('forever', 1, None)
+        fake.set('gone', 1, 0)
+        assert fake.get('gone') is None
+        with patch('time.time', return_value=time.time() + 9):
+            self.assertEqual(fake.get('k'), 1)
+        with patch('time.time', return_value=time.time() + 11):
+            assert fake.get('k') is None
+            assert fake.add('k', 2, 10)
+            self.assertEqual(fake.get('forever'), 1)
+
+
 def my_ip(req):
     return req.META['MY_THING']
 
@@ -670,3 +2459,58 @@ class IpMetaTests(TestCase):
 
         with self.assertRaises(ImproperlyConfigured):
             _get_ip(req)
+
+
+@override_settings(RATELIMIT_ALLOW_NETWORKS=['10.0.0.0/8', '2001:db8::/32'],
+                   RATELIMIT_DENY_NETWORKS=['192.0.2.0/24', '10.6.6.6'])
+class NetworkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_allow(self):
+        @ratelimit(key='ip', rate='0/m')
+        def view(request):
+            return True
+
+        with patch('django_ratelimit.core.caches') as caches_mock:
+            for ip in ('10.1.2.3', '2001:db8::1', '::ffff:10.0.0.1'):
+                req = rf.get('/', REMOTE_ADDR=ip)
+                assert view(req)
+                assert not req.limited
+        caches_mock.__getitem__.assert_not_called()
+
+    def test_deny(self):
+        @ratelimit(key='ip', rate='100/m')
+        def view(request):
+            return True
+
+        for ip in ('192.0.2.200', '10.6.6.6'):
+            with self.assertRaises(Ratelimited):
+                view(rf.get('/', REMOTE_ADDR=ip))
+        assert view(rf.get('/', REMOTE_ADDR='198.51.100.1'))
+
+    def test_malformed_address(self):
+        @ratelimit(key='get:u', rate='1/m', block=False)
+        def view(request):
+            return request.limited
+
+        assert not view(rf.get('/?u=a', REMOTE_ADDR='not-an-ip'))
+        assert view(rf.get('/?u=a', REMOTE_ADDR='not-an-ip'))
+
+    def test_concurrency(self):
+        concurrency = compile_concurrency_limit(group='net', key='ip',
+                                                limit=0)
+        assert concurrency.acquire(rf.get('/', REMOTE_ADDR='10.0.0.1'))
+        assert not concurrency.acquire(
+            rf.get('/', REMOTE_ADDR='192.0.2.1'))
+
+    def test_compile(self):
+        networks = _compile_networks(
+            ('10.0.0.0/9', '10.128.0.0/9', '10.1.0.0/16', '::1'))
+        assert networks[4] == ([10 << 24], [(11 << 24) - 1])
+        assert networks[6] == ([1], [1])
+
+    @override_settings(RATELIMIT_ALLOW_NETWORKS=['10.0.0.0/33'])
+    def test_invalid(self):
+        with self.assertRaises(ImproperlyConfigured):
+            is_ratelimited(rf.get('/'), group='net', key='ip', rate='1/m')
@@ -0,0 +1,83 @@
+"""
+Do the work that would otherwise be done by the first ratelimited request
+to each view, all at once, before the first request is handled. Run by
+RatelimitMiddleware when RATELIMIT_PRECOMPILE is set.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import URLResolver, get_resolver
+
+from django_ratelimit.core import _compile_networks, _get_clock, _hash_key
+from django_ratelimit.decorators import _get_exception_class
+
+
+__all__ = ['find_limits', 'precompile']
+
+
+def _view_limits(callback):
+    limits = list(getattr(callback, '_ratelimits', ()))
+    # Class-based views decorated with method_decorator keep their limits
+    # on the handler methods.
+    view_class = getattr(callback, 'view_class', None)
+    if view_class is not None:
+        for method in view_class.http_method_names:
+            handler = getattr(view_class, method, None)
+            limits.extend(getattr(handler, '_ratelimits', ()))
+    return limits
+
+
+def find_limits(patterns=None):
+    """
+    Return a list of (view name, limit) for every rate and concurrency
+    limit applied to a view in the URLconf.
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    found = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            found.extend(find_limits(pattern.url_patterns))
+            continue
+        callback = pattern.callback
+        view = getattr(callback, 'view_class', callback)
+        name = '%s.%s' % (getattr(view, '__module__', ''),
+                          getattr(view, '__qualname__', repr(view)))
+        found.extend((name, limit) for limit in _view_limits(callback))
+    return found
+
+
+def precompile():
+    """
+    Check and warm up every limit in the URLconf, the settings they use,
+    and the cache connection. Raises ImproperlyConfigured listing every
+    problem found.
+    """
+    errors = []
+    if getattr(settings, 'ROOT_URLCONF', None):
+        for name, limit in find_limits():
+            errors.extend('%s: %s' % (name, e) for e in limit.check())
+
+    # Import the settings that are imported lazily on first use.
+    try:
+        _get_clock()
+        _get_exception_class()
+        _hash_key(['warmup'])
+        for name in ('RATELIMIT_ALLOW_NETWORKS', 'RATELIMIT_DENY_NETWORKS'):
+            _compile_networks(tuple(getattr(settings, name, None) or ()))
+    except (ImportError, ImproperlyConfigured) as e:
+        errors.append(str(e))
+
+    if errors:
+        raise ImproperlyConfigured(
+            'Ratelimit precompilation failed:\n' + '\n'.join(errors))
+
+    # Import the backend's client library and open a connection, then close
+    # it again so it isn't shared with processes forked after loading.
+    cache = caches[getattr(settings, 'RATELIMIT_USE_CACHE', 'default')]
+    try:
+        cache.get(_hash_key(['warmup']))
+    except Exception:
+        # An unavailable cache is handled per request, like any other time.
+        pass
+    cache.close()
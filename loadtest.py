@@ -0,0 +1,196 @@
+"""
+Load test the @ratelimit decorator against the in-process redis and
+memcached stand-ins in django_ratelimit.testing.
+
+Every scenario sends requests from many threads or processes, checks that
+no key was admitted more often than its limit allows, and reports
+throughput and latency percentiles. Run with:
+
+    ./run.sh loadtest --backend memcached --mode process --workers 8
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import django
+from django.conf import settings
+
+
+BACKENDS = {
+    'redis': 'django_ratelimit.testing.FakeRedisCache',
+    'memcached': 'django_ratelimit.testing.FakeMemcachedCache',
+}
+
+
+def configure(options, address=None):
+    cache_options = {
+        'LATENCY': options.latency / 1000,
+        'FAILURE_RATE': options.failure_rate,
+    }
+    if address is not None:
+        cache_options['ADDRESS'] = address
+        cache_options['AUTHKEY'] = b'loadtest'
+    settings.configure(
+        SECRET_KEY='loadtest',
+        INSTALLED_APPS=['django_ratelimit'],
+        SILENCED_SYSTEM_CHECKS=['django_ratelimit.W001'],
+        CACHES={
+            'default': {
+                'BACKEND': BACKENDS[options.backend],
+                'LOCATION': 'loadtest',
+                'OPTIONS': cache_options,
+            },
+        },
+    )
+    django.setup()
+
+
+def make_view(rate):
+    from django_ratelimit.decorators import ratelimit
+
+    @ratelimit(group='loadtest', key='get:k', rate=rate, block=False)
+    def view(request):
+        return not request.limited
+
+    return view
+
+
+def worker(options, seed):
+    """
+    Send requests and return the number admitted per key, the latency of
+    every request and the total time taken, in seconds.
+    """
+    from django.test import RequestFactory
+
+    rf = RequestFactory()
+    rnd = random.Random(seed)
+    view = make_view(options.rate)
+    admitted = Counter()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(options.requests):
+        request = rf.get('/', {'k': str(rnd.randrange(options.keys))})
+        start = time.perf_counter()
+        if view(request):
+            admitted[request.GET['k']] += 1
+        latencies.append(time.perf_counter() - start)
+    return admitted, latencies, time.perf_counter() - started
+
+
+def _process_worker(args):
+    options, address, seed = args
+    if not settings.configured:
+        configure(options, address)
+    return worker(options, seed)
+
+
+def run_threads(options):
+    results = [None] * options.workers
+
+    def target(i):
+        results[i] = worker(options, i)
+
+    threads = [threading.Thread(target=target, args=(i,))
+               for i in range(options.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_processes(options, address):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(options.workers) as pool:
+        args = [(options, address, i) for i in range(options.workers)]
+        return pool.map(_process_worker, args)
+
+
+def report(options, results):
+    from django_ratelimit.core import _split_rate
+    from django_ratelimit.probe import percentile
+
+    limit, _ = _split_rate(options.rate)
+    admitted = Counter()
+    latencies = []
+    elapsed = 0
+    for worker_admitted, worker_latencies, worker_elapsed in results:
+        admitted.update(worker_admitted)
+        latencies.extend(worker_latencies)
+        elapsed = max(elapsed, worker_elapsed)
+    latencies.sort()
+
+    total = len(latencies)
+    over = {k: n for k, n in admitted.items() if n > limit}
+    print(f'backend={options.backend} mode={options.mode} '
+          f'workers={options.workers} keys={options.keys} '
+          f'rate={options.rate} latency={options.latency}ms '
+          f'failure_rate={options.failure_rate}')
+    print(f'requests:   {total}')
+    print(f'admitted:   {sum(admitted.values())} '
+          f'(at most {limit} per key)')
+    print(f'throughput: {total / elapsed:.0f} req/s')
+    print('latency:    ' + ' '.join(
+        f'p{p}={percentile(latencies, p) * 1000:.3f}ms'
+        for p in (50, 90, 99, 99.9)))
+    if over:
+        print(f'FAIL: {len(over)} keys over-admitted: {over}')
+        return 1
+    if not options.failure_rate:
+        # Without failures, every key must be admitted exactly up to its
+        # limit, or as many times as it was sent if that is lower.
+        sent = Counter()
+        for seed in range(options.workers):
+            rnd = random.Random(seed)
+            sent.update(str(rnd.randrange(options.keys))
+                        for _ in range(options.requests))
+        under = {k: admitted[k] for k, n in sent.items()
+                 if admitted[k] != min(n, limit)}
+        if under:
+            print(f'FAIL: {len(under)} keys under-admitted: {under}')
+            return 1
+    print('OK')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='redis')
+    parser.add_argument('--mode', choices=['thread', 'process'],
+                        default='thread')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='requests sent by each worker')
+    parser.add_argument('--keys', type=int, default=1,
+                        help='number of distinct keys, 1 for a hot key')
+    parser.add_argument('--rate', default='500/h')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated round trip time in milliseconds')
+    parser.add_argument('--failure-rate', type=float, default=0)
+    options = parser.parse_args(argv)
+
+    manager = None
+    address = None
+    if options.mode == 'process':
+        from django_ratelimit.testing import FakeServerManager
+        manager = FakeServerManager(address=('127.0.0.1', 0),
+                                    authkey=b'loadtest')
+        manager.start()
+        address = manager.address
+    configure(options, address)
+
+    if manager is None:
+        results = run_threads(options)
+    else:
+        results = run_processes(options, address)
+        manager.shutdown()
+    return report(options, results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,6 +10,7 @@ shift
 usage() {
     echo "USAGE: $PROG [command]"
     echo "  test - run the ratelimit tests"
+    echo "  loadtest - run a concurrent load test against fake caches"
     echo "  lint - run flake8 (alias: flake8)"
     echo "  shell - open the Django shell"
     echo "  build - build a package for release"
@@ -29,6 +30,9 @@ case "$CMD" in
             django_ratelimit \
             "$@"
         ;;
+    "loadtest" )
+        python loadtest.py "$@"
+        ;;
     "lint"|"flake8" )
         echo "Flake8 version: $(flake8 --version)"
         flake8 "$@" django_ratelimit/
@@ -24,6 +24,17 @@ CACHES = {
             'IGNORE_EXCEPTIONS': True,
         }
     },
+    'fake-redis': {
+        'BACKEND': 'django_ratelimit.testing.FakeRedisCache',
+        'LOCATION': 'test-fake-redis',
+    },
+    'fake-memcached-failing': {
+        'BACKEND': 'django_ratelimit.testing.FakeMemcachedCache',
+        'LOCATION': 'test-fake-memcached-failing',
+        'OPTIONS': {
+            'FAILURE_RATE': 1,
+        },
+    },
     'instant-expiration': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
         'LOCATION': 'test-instant-expiration',